@@ -4,17 +4,20 @@ ICWE 2024 Demo setup
 
 Defines the setup for the ICWE 2024 Demo.
 
-Devices is static list to keep order of devices in the UI. Modules and deployments are updated from the orchestrator on
+Devices is static list to keep order of devices in the UI. Any number of devices can be listed; if the list is left
+empty, all devices known by the orchestrator are used. Modules and deployments are updated from the orchestrator on
 startup.
 
 ..todo::
     - Add mapping for "human descriptions" for modules
 """
 
-import collections
 import logging
-from typing import List
-from ._typing import Device, Module, Deployment
+from typing import Dict, List
+from ._typing import Device, DeviceID, Module, ModuleID, Deployment
+from .deployment_index import DeploymentIndex
+from .log_queue import LogQueue
+from .settings import settings
 
 logger = logging.getLogger(__name__)
 
@@ -34,10 +37,63 @@ DEVICES: List[Device] = [
     }
 ]
 
+# If no devices are listed, all devices known by the orchestrator are used
+DISCOVER_DEVICES = not DEVICES
+
+# Device positions by name and by id. Updated by :func:`index_devices()`
+DEVICE_INDEX: Dict[str, int] = {}
+DEVICE_IDS: Dict[DeviceID, int] = {}
+
 # Updated by :func:`pull_orchestrator_modules()`
 MODULES: List[Module] = []
+MODULE_NAMES: Dict[ModuleID, str] = {}
 
 # Updated by :func:`pull_orchestrator_deployments()`
 DEPLOYMENTS: List[Deployment] = []
+DEPLOYMENT_INDEX = DeploymentIndex()
+
+# Logs waiting to be parsed, see :mod:`.log_queue`
+logs_queue = LogQueue(settings.LOG_QUEUE_CAPACITY, settings.LOG_QUEUE_LOW_WATERMARK)
+
+# Set when logs are added to :data:`logs_queue`
+logs_ready = logs_queue.ready
+
+
+def _replace(mapping: dict, items):
+    """
+    Make :param:`mapping` equal to :param:`items` in place without ever emptying it.
+
+    The mappings are imported by other modules and read from other threads while they are rebuilt, so new entries are
+    added before stale ones are dropped instead of clearing the mapping first.
+    """
+    new = dict(items)
+    mapping.update(new)
+    for key in mapping.keys() - new.keys():
+        mapping.pop(key, None)
+
+
+def index_devices():
+    """
+    Rebuild :data:`DEVICE_INDEX` and :data:`DEVICE_IDS` after :data:`DEVICES` has changed.
+    """
+    _replace(DEVICE_INDEX, ((dev['name'], idx) for idx, dev in enumerate(DEVICES) if dev.get('name')))
+    _replace(DEVICE_IDS, ((dev['_id'], idx) for idx, dev in enumerate(DEVICES) if dev.get('_id')))
+
+
+def set_modules(modules: List[Module]):
+    """
+    Replace :data:`MODULES` in place and update :data:`MODULE_NAMES`.
+    """
+    MODULES[:] = modules
+    _replace(MODULE_NAMES, ((module['_id'], module['name']) for module in modules))
+
+
+def set_deployments(deployments: List[Deployment]):
+    """
+    Replace :data:`DEPLOYMENTS` in place and update :data:`DEPLOYMENT_INDEX`.
+    """
+    DEPLOYMENTS[:] = deployments
+    DEPLOYMENT_INDEX.update(deployments)
+
 
-logs_queue = collections.deque(maxlen=256)
+index_devices()
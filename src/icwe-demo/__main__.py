@@ -1,46 +1,145 @@
 from pathlib import Path
+import multiprocessing
 import threading
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 import uvicorn
-from .ui import gradio_app
-from .utils import pull_orchestrator_deployments, pull_orchestrator_devices, pull_logs, pull_orchestrator_modules
+from .settings import settings
+from .startup import DeferredApp, profile
 import logging
 from rich.logging import RichHandler
-import gradio as gr
 
 logger = logging.getLogger(__package__)
 
-if __name__ == "__main__":
 
+def start_background_tasks():
+    """
+    Start the background tasks of this worker.
+
+    With several workers, only the elected leader runs :func:`start_leader_tasks`, and the others follow the shared
+    state, see :mod:`.shared_state`.
+    """
+    from .shared_state import get_shared_state
+
+    if (shared := get_shared_state()) is None:
+        start_leader_tasks()
+        return
+
+    # Catch up with the other workers before serving
+    shared.poll()
+    if shared.elect():
+        shared.compact()
+        start_leader_tasks()
+    else:
+        logger.info("Following shared state of the leader worker")
+    shared.start(start_leader_tasks)
+
+
+def start_leader_tasks():
+    """
+    Load orchestrator state, and start pulling and parsing logs and monitoring health.
+    """
+    from .health import get_monitor
+    from .inventory import get_inventory
+    from .recording import get_recorder, get_replay
+    from .shared_state import get_shared_state
+    from .snapshot import apply_state, load_snapshot, snapshot_state
+    from .ui import parse_logs
+    from .utils import pull_logs, pull_orchestrator_state, refresh_orchestrator_state
+
+    if (replay := get_replay()) is not None:
+        # No orchestrator or devices, everything comes from the recording
+        if not apply_state(replay.initial_state() or {}, replay.path):
+            raise SystemExit(f"No orchestrator state in recording {replay.path}")
+        if (shared := get_shared_state()) is not None:
+            shared.publish("state", state=snapshot_state())
+        threading.Thread(target=replay.run, name="replay", daemon=True).start()
+        threading.Thread(target=parse_logs, daemon=True).start()
+        return
+
+    inventory = get_inventory()
+    if settings.SNAPSHOT_PATH and load_snapshot(settings.SNAPSHOT_PATH):
+        logger.info("Refreshing orchestrator devices, modules and deployments in background...")
+        if (shared := get_shared_state()) is not None:
+            shared.publish("state", state=snapshot_state())
+        inventory.wake()
+    else:
+        logger.info("Pulling orchestrator devices, modules and deployments...")
+        pull_orchestrator_state()
+    inventory.start(refresh_orchestrator_state)
+
+    if (recorder := get_recorder()) is not None:
+        recorder.record("state", snapshot_state())
+
+    logger.info("Starting log puller...")
+    threading.Thread(target=pull_logs).start()
+    threading.Thread(target=parse_logs, daemon=True).start()
+
+    logger.info("Starting health monitor...")
+    get_monitor().start()
+
+
+def build_app():
+    """
+    Build the demo app. Runs in the background while :class:`.startup.DeferredApp` serves the starting page.
+    """
+    with profile.stage("import"):
+        from fastapi import FastAPI
+        from fastapi.responses import PlainTextResponse
+        from fastapi.staticfiles import StaticFiles
+        import gradio as gr
+        from .image_cache import ROUTE as IMAGE_ROUTE, get_image_cache
+        from .metrics import REGISTRY
+        from .ui import gradio_app
+
+    with profile.stage("orchestrator state"):
+        start_background_tasks()
+
+    with profile.stage("ui"):
+        gr_app = gradio_app()
+        gr_app.queue()
+
+    with profile.stage("mount"):
+        app = FastAPI()
+
+        static_dir = Path("./figures")
+        print(static_dir.absolute())
+        app.mount("/figures", StaticFiles(directory=static_dir), name="figures")
+        app.mount(IMAGE_ROUTE, StaticFiles(directory=get_image_cache().directory), name="results")
+
+        @app.get("/metrics", response_class=PlainTextResponse)
+        def metrics():
+            return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+        app = gr.mount_gradio_app(app, gr_app, path="/")
+
+    return app
+
+
+def serve(port: int):
     logging.basicConfig(
         level=logging.INFO,
         format=r"%(message)s",
         datefmt=r"[%X]",
         handlers=[RichHandler(rich_tracebacks=True)]
     )
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(settings.LOG_LEVEL)
 
-    logger.info("Pulling orchestrator devices, modules and deployments...")
-    pull_orchestrator_devices()
-    pull_orchestrator_modules()
-    pull_orchestrator_deployments()
+    # Bind the port before building the app, so the kiosk browser gets a starting page instead of an error
+    logger.info("Starting FastAPI server on port %d...", port)
+    uvicorn.run(DeferredApp(build_app), host="0.0.0.0", port=port)
 
-    logger.info("Starting log puller...")
-    threading.Thread(target=pull_logs).start()
-
-    gr_app = gradio_app()
-    gr_app.queue()
 
-    app = FastAPI()
+if __name__ == "__main__":
 
-    static_dir = Path("./figures")
-    print(static_dir.absolute())
-    app.mount("/figures", StaticFiles(directory=static_dir), name="figures")
+    if settings.WORKERS > 1:
+        # Start from empty shared state, like a single worker would
+        Path(settings.STATE_DIR, "journal.jsonl").unlink(missing_ok=True)
 
-    app = gr.mount_gradio_app(app, gr_app, path="/")
+        # Gradio sessions are bound to a process, so each worker serves its own port. Fork before any threads or
+        # clients are started, spawn can't import this module again.
+        context = multiprocessing.get_context("fork")
+        for worker in range(1, settings.WORKERS):
+            context.Process(target=serve, args=(settings.PORT + worker,), name=f"worker-{worker}",
+                            daemon=True).start()
 
-    #print(gr_app.launch())
-    logger.info("Starting FastAPI server...")
-    uvicorn.run(app, host="0.0.0.0", port=7860)
+    serve(settings.PORT)
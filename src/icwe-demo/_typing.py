@@ -8,8 +8,9 @@ class Device(TypedDict):
     """
     Manifest of devices, their deployements and executions.
 
-    If :param:`name` and/or :param:`address` is not provided, two of the first devices seen by orchestrator are used
-    as left and right side devices. If the devices have fixed addresses, it might be better to provide them here.
+    If :param:`address` is not provided, it is looked up from the orchestrator by :param:`name`. If no devices are
+    defined, all devices seen by orchestrator are used. If the devices have fixed addresses, it might be better to
+    provide them here.
 
     Both :param:`deployements` and :param:`executions` are lists of functions that define the deployment and execution
     pipelines. The functions are called in order.
@@ -0,0 +1,270 @@
+"""
+Benchmarks
+==========
+
+Self-contained benchmarks of the demo against the stand-in orchestrator of :mod:`.fake_orchestrator`, so regressions
+can be caught without the docker-compose stack.
+
+Measures:
+
+- ``pull_logs``: logs received per second from synthetic supervisors, and latency from the orchestrator receiving a
+  log to the demo receiving it.
+- ``log_parser``: logs parsed per second, and latency of parsing a full queue.
+- ``find_deployment_solution``: lookups per second for the fixture deployments.
+- ``health_check``: round-trip time of probing all devices and the orchestrator.
+- ``click_to_first_event``: time from starting a deployment to the first device reporting it in the chat, through the
+  stand-in orchestrator, log ingest, queue and parser.
+- ``replay``: with ``--replay``, logs of a recording parsed per second at ``--replay-speed``, see :mod:`.recording`.
+
+Run with::
+
+    python -m icwe-demo.benchmark --rate 50 --duration 5
+    python -m icwe-demo.benchmark --replay recording.jsonl --replay-speed 100
+"""
+
+import argparse
+import datetime
+import json
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def summarize(latencies: List[float], count: int | None = None, elapsed: float | None = None) -> Dict[str, float]:
+    """
+    Throughput and latency percentiles in milliseconds.
+
+    :param latencies: Latency samples in seconds
+    :param count: Number of operations, defaults to the number of samples
+    :param elapsed: Wall-clock seconds of the operations, defaults to the sum of the samples
+    """
+    count = len(latencies) if count is None else count
+    elapsed = sum(latencies) if elapsed is None else elapsed
+    result = {"count": count, "per_second": count / elapsed if elapsed else 0.}
+    if latencies:
+        ms = sorted(latency * 1000 for latency in latencies)
+        quantiles = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+        result.update(p50_ms=quantiles[49], p95_ms=quantiles[94], max_ms=ms[-1])
+    return result
+
+
+def start_orchestrator(port: int, **kwargs):
+    """
+    Serve stand-in orchestrator in a background thread.
+    """
+    import uvicorn
+    from .fake_orchestrator import create_app
+
+    server = uvicorn.Server(uvicorn.Config(create_app(**kwargs), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="fake-orchestrator", daemon=True).start()
+    while not server.started:
+        time.sleep(.01)
+    return server
+
+
+def bench_pull_logs(duration: float, mode: str) -> Dict[str, float]:
+    from .log_ingest import create_ingest
+    from .settings import settings
+
+    latencies = []
+
+    def _sink(log):
+        received = datetime.datetime.fromisoformat(log['dateReceived'])
+        latencies.append((datetime.datetime.now(datetime.UTC) - received).total_seconds())
+
+    ingest = create_ingest(settings.WASMIOT_LOGGING_ENDPOINT, _sink, mode=mode)
+    thread = threading.Thread(target=ingest.run, daemon=True)
+    started = time.monotonic()
+    thread.start()
+    time.sleep(duration)
+    ingest.stop()
+    thread.join(timeout=5.)
+    return summarize(latencies, elapsed=time.monotonic() - started)
+
+
+def bench_log_parser(count: int) -> Dict[str, float]:
+    from .fake_orchestrator import SAMPLE_MESSAGES
+    from .log_record import LogRecord, now_ms
+    from .SETUP import DEVICES, logs_queue
+    from .ui import log_parser, reset
+
+    durations = []
+    parsed = 0
+    while parsed < count:
+        batch = min(logs_queue.capacity, count - parsed)
+        now = now_ms()
+        for i in range(batch):
+            idx = i % len(DEVICES)
+            logs_queue.put(LogRecord(DEVICES[idx]['name'], idx, now, SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)]))
+        started = time.perf_counter()
+        log_parser()
+        durations.append(time.perf_counter() - started)
+        parsed += batch
+
+    reset(None, None, None)
+    return summarize(durations, count=parsed)
+
+
+def _deployment_modules() -> List[tuple]:
+    """
+    Module selections of the fixture deployments, in order of devices.
+    """
+    from .SETUP import DEPLOYMENTS, DEVICES
+
+    selections = []
+    for deployment in DEPLOYMENTS:
+        modules = {step['device']: step['module'] for step in deployment['sequence']}
+        selections.append(tuple(modules.get(device['_id']) for device in DEVICES))
+    return selections
+
+
+def bench_find_deployment(count: int) -> Dict[str, float]:
+    from .utils import find_deployment_solution
+
+    selections = _deployment_modules()
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        find_deployment_solution(*selections[i % len(selections)])
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def bench_health_check(count: int) -> Dict[str, float]:
+    from .utils import health_check
+
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        health_check()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def bench_click_to_event(count: int) -> Dict[str, float]:
+    from .ui import DEPLOYMENT_SENT, chat_history, parse_logs, start_job
+    from .utils import pull_logs
+
+    threading.Thread(target=pull_logs, daemon=True).start()
+    threading.Thread(target=parse_logs, daemon=True).start()
+
+    def _is_first(event):
+        # Parsed from the "Deployment created" log of the stand-in supervisor, not a message of the demo itself
+        return any(isinstance(msg, str) and msg.endswith(DEPLOYMENT_SENT) for msg in event)
+
+    modules = _deployment_modules()[0]
+    latencies = []
+    for _ in range(count):
+        subscription = chat_history.subscribe()
+        started = time.perf_counter()
+        job = start_job(modules, "deploy")
+        first = None
+        while first is None and subscription.wait(timeout=10.):
+            for event in subscription.read():
+                if _is_first(event):
+                    first = time.perf_counter() - started
+                    break
+        job.result()
+        if first is not None:
+            latencies.append(first)
+    return summarize(latencies)
+
+
+def bench_replay(path: str, speed: float) -> Dict[str, float]:
+    from .recording import Replay
+    from .snapshot import apply_state
+    from .SETUP import logs_queue
+    from .ui import log_parser, reset
+
+    replay = Replay(path, speed)
+    apply_state(replay.initial_state() or {}, path)
+    thread = threading.Thread(target=replay.run, daemon=True)
+
+    durations = []
+    started = time.monotonic()
+    thread.start()
+    while not (replay.done.is_set() and not logs_queue):
+        logs_queue.ready.wait(.1)
+        logs_queue.ready.clear()
+        if not logs_queue:
+            continue
+        batch_started = time.perf_counter()
+        log_parser()
+        durations.append(time.perf_counter() - batch_started)
+    elapsed = time.monotonic() - started
+
+    dropped = sum(logs_queue.take_dropped().values())
+    reset(None, None, None)
+    result = summarize(durations, count=replay.replayed, elapsed=elapsed)
+    result["dropped"] = dropped
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50., help="Synthetic log messages per second per device")
+    parser.add_argument("--duration", type=float, default=5., help="Seconds to pull logs")
+    parser.add_argument("--mode", default="poll", help="Log ingest mode, see LOG_INGEST_MODE")
+    parser.add_argument("--count", type=int, default=1000, help="Number of parsed logs and deployment lookups")
+    parser.add_argument("--rounds", type=int, default=5, help="Number of health checks and deployments")
+    parser.add_argument("--replay", help="Recording to replay, see RECORD_PATH")
+    parser.add_argument("--replay-speed", type=float, default=0., help="Replay speed, 0 for as fast as possible")
+    parser.add_argument("--json", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    store_dir = tempfile.TemporaryDirectory(prefix="icwe-demo-bench-")
+
+    # Settings are read on import, so configure before importing the demo
+    os.environ.update({
+        "WASMIOT_ORCHESTRATOR_URL": url,
+        "WASMIOT_LOGGING_ENDPOINT": f"{url}/device/logs",
+        "LOG_INGEST_MODE": args.mode,
+        "SNAPSHOT_PATH": "",
+        "DEPLOY_CACHE": "false",
+        "LOG_STORE_DIR": store_dir.name,
+    })
+
+    from .SETUP import DEVICES
+    from .utils import pull_orchestrator_state
+
+    start_orchestrator(port, rate=args.rate, deploy_delay=0., execute_delay=0.)
+    pull_orchestrator_state("")
+    for device in DEVICES:
+        device['address'] = f"{url}/supervisors/{device['name']}"
+
+    results = {
+        "pull_logs": bench_pull_logs(args.duration, args.mode),
+        "log_parser": bench_log_parser(args.count),
+        "find_deployment_solution": bench_find_deployment(args.count),
+        "health_check": bench_health_check(args.rounds),
+        "click_to_first_event": bench_click_to_event(args.rounds),
+    }
+    if args.replay:
+        results["replay"] = bench_replay(args.replay, args.replay_speed)
+
+    print(f"{'benchmark':<26}{'count':>8}{'per second':>12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<26}{result['count']:>8}{result['per_second']:>12.1f}"
+              + "".join(f"{result.get(key, float('nan')):>10.2f}" for key in ("p50_ms", "p95_ms", "max_ms")))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    store_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
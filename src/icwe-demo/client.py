@@ -0,0 +1,249 @@
+"""
+Orchestrator client
+===================
+
+Shared HTTP client for talking to the orchestrator and devices.
+
+All requests go through a single :class:`httpx.AsyncClient` with a keep-alive connection pool, running on a
+background event loop. Blocking code, like the Gradio callbacks, uses the sync facade (:meth:`OrchestratorClient.get`,
+:meth:`OrchestratorClient.post`), which runs the request on that loop and waits for the result.
+
+Each request names an endpoint, which selects its timeout from :attr:`OrchestratorClient.TIMEOUTS`. Failed requests
+are retried with backoff, limited by a shared retry budget so that a down orchestrator isn't hammered by retries.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Coroutine, Iterator, TypeVar
+
+import httpx
+
+from . import metrics
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Responses with these statuses are retried for idempotent requests.
+RETRY_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+REQUEST_SECONDS = metrics.Histogram("icwe_http_request_seconds", "Duration of requests, including retries",
+                                    ["endpoint", "status"])
+REQUEST_RETRIES = metrics.Counter("icwe_http_request_retries_total", "Retried requests", ["endpoint"])
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of requests.
+
+    Every request deposits :param:`ratio` tokens, up to :param:`max_tokens`. Every retry withdraws one token.
+
+    :param ratio: Retries allowed per request
+    :param max_tokens: Maximum retries allowed in a burst
+    """
+
+    def __init__(self, ratio: float = .2, max_tokens: float = 10.):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class OrchestratorClient:
+    """
+    HTTP client with a keep-alive connection pool and a sync facade.
+
+    :param base_url: Base URL for relative request URLs. Absolute URLs, like device addresses, are used as is.
+    :param max_connections: Connection pool size
+    :param retries: Maximum retries per request
+    """
+
+    # Timeouts (in seconds) by endpoint name
+    TIMEOUTS: dict[str, float] = {
+        "devices": 10.,
+        "modules": 10.,
+        "deployments": 10.,
+        "deploy": 120.,
+        "execute": 120.,
+        "health": 3.,
+        "logs": 10.,
+        "image": 30.,
+    }
+    DEFAULT_TIMEOUT = 10.
+
+    def __init__(self,
+                 base_url: str = settings.WASMIOT_ORCHESTRATOR_URL,
+                 max_connections: int = settings.ORCHESTRATOR_MAX_CONNECTIONS,
+                 retries: int = settings.ORCHESTRATOR_RETRIES):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.retries = retries
+        self.budget = RetryBudget()
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Event loop of the client, started on first use.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="orchestrator-client", daemon=True).start()
+        return self._loop
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.DEFAULT_TIMEOUT)
+        return self._client
+
+    def timeout(self, endpoint: str) -> float:
+        return self.TIMEOUTS.get(endpoint, self.DEFAULT_TIMEOUT)
+
+    async def arequest(self, method: str, url: str, *, endpoint: str, retries: int | None = None,
+                       **kwargs) -> httpx.Response:
+        """
+        Send request, retrying on connection errors and gateway errors.
+
+        Non-idempotent requests are only retried if the connection could not be made.
+
+        :param endpoint: Endpoint name, see :attr:`TIMEOUTS`
+        :param retries: Override :attr:`retries`
+        """
+        started = time.perf_counter()
+        status = "error"
+        try:
+            res = await self._arequest(method, url, endpoint=endpoint, retries=retries, **kwargs)
+            status = str(res.status_code)
+            return res
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=status)
+
+    async def _arequest(self, method: str, url: str, *, endpoint: str, retries: int | None, **kwargs) -> httpx.Response:
+        method = method.upper()
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        self.budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                res = await self._http().request(method, url, **kwargs)
+                if res.status_code not in RETRY_STATUSES or method not in IDEMPOTENT_METHODS:
+                    return res
+                error: Exception = httpx.HTTPStatusError(f"{res.status_code}", request=res.request, response=res)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = e
+            except httpx.TransportError as e:
+                if method not in IDEMPOTENT_METHODS:
+                    raise
+                error = e
+
+            if attempt >= retries or not self.budget.withdraw():
+                if isinstance(error, httpx.HTTPStatusError):
+                    return error.response
+                raise error
+
+            attempt += 1
+            REQUEST_RETRIES.inc(endpoint=endpoint)
+            logger.debug("Retrying %s %s (%d/%d) after: %s", method, url, attempt, retries, error)
+            await asyncio.sleep(.1 * 2 ** attempt)
+
+    async def aget(self, url: str, *, endpoint: str, **kwargs) -> httpx.Response:
+        return await self.arequest("GET", url, endpoint=endpoint, **kwargs)
+
+    async def apost(self, url: str, *, endpoint: str, **kwargs) -> httpx.Response:
+        return await self.arequest("POST", url, endpoint=endpoint, **kwargs)
+
+    async def astream_lines(self, url: str, *, endpoint: str, **kwargs) -> AsyncIterator[httpx.Response | str]:
+        """
+        Stream response lines. The response is yielded first, so the caller can check headers.
+        """
+        kwargs.setdefault("timeout", httpx.Timeout(self.timeout(endpoint), connect=5.))
+        async with self._http().stream("GET", url, **kwargs) as res:
+            yield res
+            async for line in res.aiter_lines():
+                yield line
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        """
+        Schedule coroutine on the client event loop.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """
+        Run coroutine on the client event loop and wait for the result.
+        """
+        return self.submit(coro).result()
+
+    def get(self, url: str, *, endpoint: str, **kwargs) -> httpx.Response:
+        return self.run(self.aget(url, endpoint=endpoint, **kwargs))
+
+    def post(self, url: str, *, endpoint: str, **kwargs) -> httpx.Response:
+        return self.run(self.apost(url, endpoint=endpoint, **kwargs))
+
+    def stream_lines(self, url: str, *, endpoint: str, **kwargs) -> Iterator[httpx.Response | str]:
+        """
+        Sync facade for :meth:`astream_lines`.
+        """
+        agen = self.astream_lines(url, endpoint=endpoint, **kwargs)
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.submit(agen.aclose())
+
+    def download(self, url: str, save_path: str, *, endpoint: str = "image"):
+        """
+        Stream response body to a file.
+        """
+        async def _download():
+            async with self._http().stream("GET", url, timeout=self.timeout(endpoint)) as res:
+                res.raise_for_status()
+                with open(save_path, 'wb') as file:
+                    async for chunk in res.aiter_bytes(chunk_size=8192):
+                        file.write(chunk)
+
+        self.run(_download())
+
+    def close(self):
+        if self._client is not None:
+            self.run(self._client.aclose())
+            self._client = None
+
+
+_client: OrchestratorClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OrchestratorClient:
+    """
+    Get the shared :class:`OrchestratorClient`.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OrchestratorClient()
+    return _client
@@ -0,0 +1,89 @@
+"""
+Deployed state
+==============
+
+What is currently deployed on each device, so that deploying a solution that is already in place can be skipped.
+
+Supervisors keep every deployment they have received, so a device can have several deployments at once, and switching
+back to an earlier configuration doesn't need a redeploy. Deployments are recorded by a fingerprint of their manifest,
+so a manifest changed in the orchestrator is deployed again. A device is forgotten when it fails a health check, as it
+may have restarted and lost its deployments.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List
+
+from ._typing import Deployment, DeploymentID, DeviceID
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(deployment: Deployment) -> str:
+    """
+    Hash of the deployment manifest.
+    """
+    content = json.dumps(deployment, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def deployment_devices(deployment: Deployment) -> List[DeviceID]:
+    return list(dict.fromkeys(step['device'] for step in deployment['sequence']))
+
+
+class DeployedState:
+    """
+    Deployments known to be on each device.
+    """
+
+    def __init__(self):
+        self._deployed: Dict[DeviceID, Dict[DeploymentID, str]] = {}
+        self._lock = threading.Lock()
+
+    def missing(self, deployment: Deployment) -> List[DeviceID]:
+        """
+        Devices of :param:`deployment` that don't have its current manifest.
+        """
+        digest = fingerprint(deployment)
+        with self._lock:
+            return [device for device in deployment_devices(deployment)
+                    if self._deployed.get(device, {}).get(deployment['_id']) != digest]
+
+    def is_deployed(self, deployment: Deployment) -> bool:
+        return not self.missing(deployment)
+
+    def record(self, deployment: Deployment, devices: Iterable[DeviceID] | None = None):
+        """
+        Record :param:`deployment` as deployed on :param:`devices`, defaults to all of its devices.
+        """
+        digest = fingerprint(deployment)
+        with self._lock:
+            for device in deployment_devices(deployment) if devices is None else devices:
+                self._deployed.setdefault(device, {})[deployment['_id']] = digest
+
+    def forget(self, device: DeviceID | None = None):
+        """
+        Forget deployments of :param:`device`, or of all devices.
+        """
+        with self._lock:
+            if device is None:
+                self._deployed.clear()
+            elif self._deployed.pop(device, None):
+                logger.debug("Forgot deployments of device %s", device)
+
+
+_state: DeployedState | None = None
+_state_lock = threading.Lock()
+
+
+def get_deployed_state() -> DeployedState:
+    """
+    Get the shared :class:`DeployedState`.
+    """
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = DeployedState()
+    return _state
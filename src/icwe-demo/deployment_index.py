@@ -0,0 +1,126 @@
+"""
+Deployment index
+================
+
+Lookup table from (device, module) steps to deployments, so that finding a deployment for the selected modules
+doesn't scan all deployments.
+
+Deployments are indexed both by their exact sequence and by the steps regardless of order, as the demo doesn't care
+which device starts the sequence.
+"""
+
+import collections
+import logging
+from typing import Counter, Dict, Iterable, List, Set, Tuple
+
+from ._typing import Deployment, DeploymentID, DeviceID, ModuleID
+
+logger = logging.getLogger(__name__)
+
+Step = Tuple[DeviceID, ModuleID]
+SequenceKey = Tuple[Step, ...]
+
+
+def sequence_key(deployment: Deployment) -> SequenceKey:
+    return tuple((step['device'], step['module']) for step in deployment['sequence'])
+
+
+def steps_key(steps: Iterable[Step]) -> SequenceKey:
+    """
+    Order-insensitive key for steps.
+    """
+    return tuple(sorted(steps))
+
+
+class DeploymentIndex:
+    """
+    Index of deployments by their (device, module) steps.
+    """
+
+    def __init__(self):
+        self._deployments: Dict[DeploymentID, Deployment] = {}
+        self._keys: Dict[DeploymentID, SequenceKey] = {}
+        self._by_sequence: Dict[SequenceKey, List[DeploymentID]] = {}
+        self._by_steps: Dict[SequenceKey, List[DeploymentID]] = {}
+        # Number of deployments using each step, for listing modules per device
+        self._steps: Counter[Step] = collections.Counter()
+
+    def __len__(self):
+        return len(self._deployments)
+
+    def __contains__(self, deployment_id: DeploymentID):
+        return deployment_id in self._deployments
+
+    def add(self, deployment: Deployment):
+        if deployment['_id'] in self._deployments:
+            self.remove(deployment['_id'])
+
+        key = sequence_key(deployment)
+        self._deployments[deployment['_id']] = deployment
+        self._keys[deployment['_id']] = key
+        self._by_sequence.setdefault(key, []).append(deployment['_id'])
+        self._by_steps.setdefault(steps_key(key), []).append(deployment['_id'])
+        self._steps.update(set(key))
+
+    def remove(self, deployment_id: DeploymentID):
+        key = self._keys.pop(deployment_id)
+        del self._deployments[deployment_id]
+        self._steps.subtract(set(key))
+        for step in set(key):
+            if self._steps[step] <= 0:
+                del self._steps[step]
+        for table, table_key in ((self._by_sequence, key), (self._by_steps, steps_key(key))):
+            ids = table[table_key]
+            ids.remove(deployment_id)
+            if not ids:
+                del table[table_key]
+
+    def update(self, deployments: Iterable[Deployment]) -> Tuple[int, int]:
+        """
+        Update index to match :param:`deployments`, only touching deployments that were added, removed or changed.
+
+        :return: Number of deployments (added or changed, removed)
+        """
+        seen = set()
+        changed = 0
+        for deployment in deployments:
+            seen.add(deployment['_id'])
+            if self._keys.get(deployment['_id']) == sequence_key(deployment):
+                # Sequence is the same, but keep the latest manifest
+                self._deployments[deployment['_id']] = deployment
+                continue
+            self.add(deployment)
+            changed += 1
+
+        removed = [deployment_id for deployment_id in self._deployments if deployment_id not in seen]
+        for deployment_id in removed:
+            self.remove(deployment_id)
+
+        if changed or removed:
+            logger.debug("Deployment index updated: %d added or changed, %d removed", changed, len(removed))
+        return changed, len(removed)
+
+    def steps(self) -> Set[Step]:
+        """
+        All (device, module) steps used by any deployment.
+        """
+        return set(self._steps)
+
+    def get(self, deployment_id: DeploymentID) -> Deployment | None:
+        return self._deployments.get(deployment_id)
+
+    def find_sequence(self, steps: Iterable[Step]) -> Deployment | None:
+        """
+        Find deployment with exactly the given sequence of steps.
+        """
+        if ids := self._by_sequence.get(tuple(steps)):
+            return self._deployments[ids[0]]
+        return None
+
+    def find(self, steps: Iterable[Step]) -> Deployment | None:
+        """
+        Find deployment with the given steps in any order.
+        """
+        if ids := self._by_steps.get(steps_key(steps)):
+            return self._deployments[ids[0]]
+        return None
@@ -0,0 +1,210 @@
+"""
+Event bus
+=========
+
+Publish/subscribe bus for chat events, so that every connected viewer sees the same flow.
+
+Events are kept once in a bounded ring buffer. Each :class:`Subscription` only holds a cursor (sequence number) into
+it, so adding viewers doesn't copy events. A subscriber that falls behind by more than the buffer capacity skips the
+overwritten events, and they are counted in :attr:`Subscription.missed`.
+
+:meth:`EventBus.restore` replaces the events, like :meth:`EventBus.clear`, but subscribers take the restored events as
+their new view instead of reading them as new events. Events changed in place, like the count of a repeated message,
+are announced with :meth:`EventBus.touch`.
+"""
+
+import threading
+from typing import Generic, List, Tuple, TypeVar
+
+from .log_buffer import ChangeNotifier
+
+T = TypeVar("T")
+
+
+class EventBus(Generic[T]):
+    """
+    Bounded ring buffer of events with per-subscriber cursors.
+
+    :param capacity: Number of events kept for subscribers
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self._events: List[T | None] = [None] * capacity
+        self._head = 0  # Sequence number of the next event
+        self._tail = 0  # Sequence number of the first event after last :meth:`clear`
+        self._restored = 0  # Sequence number after the events of last :meth:`restore`
+        self._cond = threading.Condition()
+
+        #: Incremented on :meth:`clear`, so that subscribers can reset their views
+        self.epoch = 0
+
+        #: Incremented on :meth:`touch`, so that subscribers can redraw their views
+        self.revision = 0
+
+        #: Notified on publish and clear, for async subscribers
+        self.updates = ChangeNotifier()
+
+    def __len__(self):
+        return self._head - self._first(self._tail)
+
+    @property
+    def head(self) -> int:
+        return self._head
+
+    def _first(self, cursor: int) -> int:
+        return max(cursor, self._tail, self._head - self.capacity)
+
+    def publish(self, event: T) -> int:
+        """
+        Publish event to all subscribers.
+
+        :return: Sequence number of the event
+        """
+        with self._cond:
+            seq = self._head
+            self._events[seq % self.capacity] = event
+            self._head += 1
+            self._cond.notify_all()
+        self.updates.notify()
+        return seq
+
+    def touch(self):
+        """
+        Notify subscribers that published events were changed in place.
+        """
+        with self._cond:
+            self.revision += 1
+            self._cond.notify_all()
+        self.updates.notify()
+
+    def read(self, cursor: int, limit: int | None = None) -> Tuple[List[T], int, int]:
+        """
+        Read events starting from :param:`cursor`.
+
+        :return: Events, next cursor and number of events missed since the cursor
+        """
+        with self._cond:
+            first = self._first(cursor)
+            last = self._head if limit is None else min(self._head, first + limit)
+            events = [self._events[seq % self.capacity] for seq in range(first, last)]
+        missed = max(0, first - cursor) if cursor >= self._tail else 0
+        return events, last, missed
+
+    def wait(self, cursor: int, timeout: float | None = None) -> bool:
+        """
+        Wait until there are events after :param:`cursor`.
+
+        :return: ``False`` if timed out
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._head > self._first(cursor), timeout)
+
+    def clear(self):
+        """
+        Drop all events for all subscribers.
+        """
+        self.restore([])
+
+    def restore(self, events: List[T]):
+        """
+        Replace all events with :param:`events`, for example when rebuilding state. Subscribers get them from
+        :meth:`Subscription.rebase`, not as new events.
+        """
+        with self._cond:
+            self._tail = self._head
+            for event in events[-self.capacity:]:
+                self._events[self._head % self.capacity] = event
+                self._head += 1
+            self._restored = self._head
+            self.epoch += 1
+            self._cond.notify_all()
+        self.updates.notify()
+
+    def restored(self) -> Tuple[List[T], int]:
+        """
+        Events of the last :meth:`restore` that are still kept.
+
+        :return: Events and the cursor after them
+        """
+        with self._cond:
+            first = self._first(0)
+            last = max(first, self._restored)
+            return [self._events[seq % self.capacity] for seq in range(first, last)], last
+
+    def subscribe(self, from_start: bool = False) -> "Subscription[T]":
+        """
+        Subscribe to events.
+
+        :param from_start: Start from the oldest kept event instead of the next published one.
+        """
+        return Subscription(self, self._first(0) if from_start else self._head)
+
+
+class Subscription(Generic[T]):
+    """
+    Cursor of a single subscriber into :class:`EventBus`.
+    """
+
+    def __init__(self, bus: EventBus[T], cursor: int):
+        self.bus = bus
+        self.cursor = cursor
+        self.epoch = bus.epoch
+        self.revision = bus.revision
+        self.missed = 0
+
+    def __len__(self):
+        """
+        Number of events not read yet.
+        """
+        return self.bus.head - self.bus._first(self.cursor)
+
+    def read(self, limit: int | None = None) -> List[T]:
+        events, self.cursor, missed = self.bus.read(self.cursor, limit)
+        self.missed += missed
+        return events
+
+    def next(self) -> T | None:
+        """
+        Read the next event, or ``None`` if there are none.
+        """
+        events = self.read(limit=1)
+        return events[0] if events else None
+
+    def was_cleared(self) -> bool:
+        """
+        Check whether the bus was cleared since the last call.
+        """
+        if self.epoch != self.bus.epoch:
+            self.epoch = self.bus.epoch
+            return True
+        return False
+
+    def was_updated(self) -> bool:
+        """
+        Check whether events were changed in place since the last call.
+        """
+        if self.revision != self.bus.revision:
+            self.revision = self.bus.revision
+            return True
+        return False
+
+    def rebase(self) -> List[T]:
+        """
+        Skip to the end of the events the bus was restored with, after :meth:`was_cleared`.
+
+        :return: The restored events
+        """
+        events, cursor = self.bus.restored()
+        self.cursor = max(self.cursor, cursor)
+        return events
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.bus.wait(self.cursor, timeout)
+
+    async def wait_async(self, timeout: float | None = None) -> bool:
+        """
+        Wait for new, cleared or changed events without blocking the event loop.
+        """
+        return await self.bus.updates.wait(timeout, predicate=lambda: (len(self) or self.epoch != self.bus.epoch
+                                                                       or self.revision != self.bus.revision))
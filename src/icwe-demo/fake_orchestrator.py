@@ -0,0 +1,209 @@
+"""
+Stand-in orchestrator
+=====================
+
+Local stand-in for the orchestrator, for testing and benchmarking the demo without the docker-compose stack.
+
+Serves ``/device/logs`` like the orchestrator does, with the optional long-poll (``wait``) and streaming
+(``stream``, server-sent events) modes used by :mod:`.log_ingest`. Logs can be posted to the same endpoint, or
+generated with ``--rate``.
+
+Devices, modules and deployments are served from the fixtures in ``test_system/orchestrator-init``. Deploying and
+executing a deployment answer after a configurable delay, and the synthetic supervisors of its devices log what they
+would do. Supervisor health checks are served from ``/supervisors/<device name>/health``.
+
+Run with::
+
+    python -m icwe-demo.fake_orchestrator --port 3000 --rate 2
+    LOG_INGEST_MODE=stream WASMIOT_ORCHESTRATOR_URL=http://localhost:3000 python -m icwe-demo
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+from pathlib import Path
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from .SETUP import DEVICES
+
+#: Fixtures of the docker-compose setup
+FIXTURES = Path(__file__).resolve().parents[2] / "test_system" / "orchestrator-init"
+
+SAMPLE_MESSAGES = [
+    "Health check done",
+    "Preparing Wasm module 'camera'",
+    "Running Wasm function 'take_image_predefined_path'",
+    "Execution result: 1",
+]
+
+
+class LogStore:
+    """
+    In-memory log list with a condition for waiting new entries.
+    """
+
+    def __init__(self):
+        self.logs: list[dict] = []
+        self.changed = asyncio.Condition()
+
+    async def append(self, log: dict):
+        now = datetime.datetime.now(datetime.UTC)
+        log.setdefault('timestamp', now.isoformat())
+        log.setdefault('loglevel', "INFO")
+        log['dateReceived'] = now.isoformat()
+        async with self.changed:
+            self.logs.append(log)
+            self.changed.notify_all()
+
+    def after(self, after: datetime.datetime | None) -> list[dict]:
+        if after is None:
+            return list(self.logs)
+        # Logs are appended in order of receiving, so walk from the end.
+        idx = len(self.logs)
+        while idx > 0 and datetime.datetime.fromisoformat(self.logs[idx - 1]['dateReceived']) > after:
+            idx -= 1
+        return self.logs[idx:]
+
+    async def wait_after(self, after: datetime.datetime | None, timeout: float) -> list[dict]:
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(lambda: self.after(after)), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.after(after)
+
+
+def load_fixtures(path: Path = FIXTURES) -> dict[str, bytes]:
+    """
+    Read orchestrator listings from the fixtures directory.
+    """
+    return {
+        "device": (path / "device" / "devices.json").read_bytes(),
+        "module": (path / "module" / "modules.json").read_bytes(),
+        "manifest": (path / "deployment" / "manifests.json").read_bytes(),
+    }
+
+
+def create_app(rate: float = 0., fixtures: Path = FIXTURES, deploy_delay: float = .2,
+               execute_delay: float = .5) -> FastAPI:
+    """
+    Create stand-in orchestrator app.
+
+    :param rate: Generate this many synthetic log messages per second per device
+    :param fixtures: Directory of orchestrator fixtures
+    :param deploy_delay: Seconds before a deployment is answered
+    :param execute_delay: Seconds before an execution is answered
+    """
+    app = FastAPI(title="Stand-in orchestrator")
+    store = LogStore()
+    app.state.logs = store
+
+    listings = load_fixtures(fixtures)
+    devices = {device['_id']: device for device in json.loads(listings["device"])}
+    deployments = {deployment['_id']: deployment for deployment in json.loads(listings["manifest"])}
+    etags = {name: f'"{hashlib.blake2b(content, digest_size=8).hexdigest()}"' for name, content in listings.items()}
+
+    async def supervisor_log(device_id: str, message: str):
+        if device := devices.get(device_id):
+            await store.append({"deviceName": device['name'], "message": message})
+
+    @app.on_event("startup")
+    async def _start_generator():
+        if rate > 0:
+            asyncio.create_task(_generate(store, rate))
+
+    @app.get("/file/{listing}")
+    async def get_listing(listing: str, request: Request):
+        if listing not in listings:
+            raise HTTPException(404)
+        if request.headers.get("if-none-match") == etags[listing]:
+            return Response(status_code=304)
+        return Response(listings[listing], media_type="application/json", headers={"ETag": etags[listing]})
+
+    @app.post("/file/manifest/{deployment_id}")
+    async def deploy(deployment_id: str):
+        if (deployment := deployments.get(deployment_id)) is None:
+            raise HTTPException(404)
+        await asyncio.sleep(deploy_delay)
+        device_ids = list(dict.fromkeys(step['device'] for step in deployment['sequence']))
+        for device_id in device_ids:
+            await supervisor_log(device_id, "Deployment created")
+        return {"deviceResponses": {device_id: {"data": {"status": "success"}} for device_id in device_ids}}
+
+    @app.post("/execute/{deployment_id}")
+    async def execute(deployment_id: str):
+        if (deployment := deployments.get(deployment_id)) is None:
+            raise HTTPException(404)
+        for step in deployment['sequence']:
+            await supervisor_log(step['device'], f"Running Wasm function '{step['func']}'")
+        await asyncio.sleep(execute_delay)
+        await supervisor_log(deployment['sequence'][-1]['device'], f"Execution result: {random.randint(1, 1000)}")
+        return {"status": "ok"}
+
+    @app.get("/health")
+    @app.get("/supervisors/{name}/health")
+    async def health(name: str | None = None):
+        return {"status": "ok"}
+
+    @app.get("/device/logs")
+    async def get_logs(request: Request, after: str | None = None, wait: float = 0., stream: bool = False):
+        after_dt = datetime.datetime.fromisoformat(after) if after else None
+
+        if stream and "text/event-stream" in request.headers.get("accept", ""):
+            return StreamingResponse(_sse(store, after_dt, wait or 25.), media_type="text/event-stream")
+
+        if wait > 0:
+            return await store.wait_after(after_dt, wait)
+        return store.after(after_dt)
+
+    @app.post("/device/logs")
+    async def post_log(request: Request):
+        if request.headers.get("content-type", "").startswith("application/json"):
+            log = await request.json()
+        else:
+            log = dict(await request.form())
+        await store.append(log)
+        return {"status": "ok"}
+
+    return app
+
+
+async def _sse(store: LogStore, after: datetime.datetime | None, keepalive: float):
+    while True:
+        logs = await store.wait_after(after, keepalive)
+        if not logs:
+            yield ": keepalive\n\n"
+            continue
+        after = datetime.datetime.fromisoformat(logs[-1]['dateReceived'])
+        yield f"data: {json.dumps(logs)}\n\n"
+
+
+async def _generate(store: LogStore, rate: float):
+    while True:
+        await asyncio.sleep(random.expovariate(rate * len(DEVICES)))
+        await store.append({
+            "deviceName": random.choice(DEVICES)['name'],
+            "message": random.choice(SAMPLE_MESSAGES),
+        })
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=0., help="Synthetic log messages per second per device")
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES, help="Directory of orchestrator fixtures")
+    parser.add_argument("--deploy-delay", type=float, default=.2, help="Seconds before a deployment is answered")
+    parser.add_argument("--execute-delay", type=float, default=.5, help="Seconds before an execution is answered")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(rate=args.rate, fixtures=args.fixtures, deploy_delay=args.deploy_delay,
+                           execute_delay=args.execute_delay),
+                host=args.host, port=args.port)
@@ -0,0 +1,239 @@
+"""
+Health monitor
+==============
+
+Background health checks of the devices and the orchestrator.
+
+:class:`HealthMonitor` probes all targets concurrently on a schedule, over the shared connection pool of
+:mod:`.client`, and keeps rolling latency and availability per target. Consumers, like the health button, read the
+cached :meth:`HealthMonitor.status` instead of waiting for the probes.
+"""
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+from typing import Deque, Dict, List
+
+import httpx
+
+from . import metrics, shared_state
+from .client import OrchestratorClient, get_client
+from .deployed import get_deployed_state
+from .recording import get_recorder
+from .settings import settings
+from .SETUP import DEVICE_INDEX, DEVICES
+
+logger = logging.getLogger(__name__)
+
+PROBE_SECONDS = metrics.Histogram("icwe_health_probe_seconds", "Round-trip time of answered health probes", ["target"])
+
+
+class TargetHealth:
+    """
+    Rolling health of a single target.
+
+    :param name: Name of the device, or ``"orchestrator"``
+    :param window: Number of probes kept for latency and availability
+    """
+
+    def __init__(self, name: str, window: int = settings.HEALTH_WINDOW):
+        self.name = name
+        self.address: str | None = None
+        self.ok: bool | None = None
+        self.error: str | None = None
+        self.last_checked: float | None = None
+        self.results: Deque[bool] = collections.deque(maxlen=window)
+        self.rtts: Deque[float] = collections.deque(maxlen=window)
+
+    def record(self, ok: bool, rtt: float | None = None, error: str | None = None):
+        self.ok = ok
+        self.error = error
+        self.last_checked = time.time()
+        self.results.append(ok)
+        if rtt is not None:
+            self.rtts.append(rtt)
+
+    @property
+    def latency(self) -> float | None:
+        """
+        Mean round-trip time of successful probes in seconds.
+        """
+        return sum(self.rtts) / len(self.rtts) if self.rtts else None
+
+    @property
+    def availability(self) -> float | None:
+        """
+        Fraction of successful probes.
+        """
+        return sum(self.results) / len(self.results) if self.results else None
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "address": self.address,
+            "ok": self.ok,
+            "error": self.error,
+            "last_checked": self.last_checked,
+            "latency": self.latency,
+            "availability": self.availability,
+        }
+
+
+class HealthMonitor:
+    """
+    Probe devices and orchestrator every :param:`interval` seconds.
+
+    :param interval: Seconds between probe rounds
+    :param client: Client to use, defaults to the shared :func:`.client.get_client`
+    """
+
+    def __init__(self, interval: float = settings.HEALTH_CHECK_INTERVAL, client: OrchestratorClient | None = None):
+        self.interval = interval
+        self.client = client or get_client()
+        self.targets: Dict[str, TargetHealth] = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        #: Status of the monitor of the leader worker or of a recording, see :meth:`follow`
+        self.shared_status: Dict[str, dict] | None = None
+
+    def _target_list(self) -> List[dict]:
+        return DEVICES + [{
+            "name": "orchestrator",
+            "address": settings.WASMIOT_ORCHESTRATOR_URL,
+        }]
+
+    async def probe(self, target: dict):
+        # Imported here, as utils uses the monitor
+        from .utils import device_log
+
+        health = self.targets.setdefault(target['name'], TargetHealth(target['name']))
+        health.address = target.get('address')
+        was_ok = health.ok
+
+        url = f"{target.get('address')}/health"
+        started = time.monotonic()
+        try:
+            res = await self.client.aget(url, endpoint="health", retries=0)
+            rtt = time.monotonic() - started
+            PROBE_SECONDS.observe(rtt, target=target['name'])
+            if res.is_success:
+                health.record(True, rtt)
+            else:
+                health.record(False, rtt, f"HTTP {res.status_code}")
+        except httpx.TimeoutException:
+            health.record(False, error=f"Timeout connecting to {url}")
+        except httpx.HTTPError as e:
+            health.record(False, error=repr(e))
+
+        # Only report changes, not every probe
+        if health.ok and was_ok is not True:
+            device_log("🩺 Health check to %s ok (%.0f ms)", url, health.rtts[-1] * 1000, device=target)
+        elif not health.ok and was_ok is not False:
+            device_log("🤕 Health check failed: %s", health.error, level=logging.ERROR, device=target)
+            if device_id := target.get('_id'):
+                # Device may restart without its deployments
+                get_deployed_state().forget(device_id)
+
+    def probe_all(self):
+        """
+        Probe all targets concurrently and wait for the results.
+        """
+        async def _probe_all():
+            await asyncio.gather(*(self.probe(target) for target in self._target_list()))
+
+        self.client.run(_probe_all())
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                self.probe_all()
+                if (shared := shared_state.get_shared_state()) is not None:
+                    shared.publish("health", status=self.status())
+                if (recorder := get_recorder()) is not None:
+                    recorder.record("health", self.status())
+            except Exception as e:
+                logger.error("Error checking health: %s", e, exc_info=True)
+            self._wakeup.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="health-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """
+        Probe again without waiting for the interval.
+        """
+        self._wakeup.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self) -> Dict[str, dict]:
+        """
+        Cached health of all targets.
+        """
+        return {name: health.as_dict() for name, health in list(self.targets.items())}
+
+    def follow(self, status: Dict[str, dict]):
+        """
+        Serve :param:`status` of another monitor, like the leader worker of :mod:`.shared_state` or a recording,
+        instead of probing.
+        """
+        self.shared_status = status
+        for target in status.values():
+            if target['ok'] is False and (idx := DEVICE_INDEX.get(target['name'])) is not None:
+                if device_id := DEVICES[idx].get('_id'):
+                    # Device may restart without its deployments
+                    get_deployed_state().forget(device_id)
+
+    def healthy(self) -> bool:
+        """
+        Whether all targets passed their latest probe. Targets not probed yet count as healthy.
+        """
+        if not self.running and self.shared_status is not None:
+            return all(status['ok'] is not False for status in self.shared_status.values())
+        return all(health.ok is not False for health in list(self.targets.values()))
+
+
+_monitor: HealthMonitor | None = None
+_monitor_lock = threading.Lock()
+
+
+def get_monitor() -> HealthMonitor:
+    """
+    Get the shared :class:`HealthMonitor`.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = HealthMonitor()
+    return _monitor
+
+
+metrics.Gauge("icwe_health_up", "Whether the latest health probe of a target passed", ["target"],
+              function=lambda: {(name,): float(health.ok) for name, health in list(get_monitor().targets.items())
+                                if health.ok is not None})
+
+
+@shared_state.on("health")
+def _on_shared_health(entry):
+    if not (monitor := get_monitor()).running:
+        monitor.follow(entry['status'])
+
+
+@shared_state.snapshot
+def _shared_snapshot():
+    monitor = get_monitor()
+    if (status := monitor.status() if monitor.running else monitor.shared_status) is not None:
+        yield "health", {"status": status}
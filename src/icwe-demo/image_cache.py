@@ -0,0 +1,208 @@
+"""
+Result image cache
+==================
+
+Local cache of result images shown in the chat.
+
+Devices serve their latest result, like a camera frame, from the same URL every time. Instead of every browser
+downloading the full image from the device, :class:`ImageCache` fetches it once per result, stores it on disk under its
+content hash, and makes a small thumbnail for the chat bubble. Both are served by the demo server from
+:data:`ROUTE`, and as their names change with the content, browsers can cache them without cache busting.
+
+The cache is a least recently used cache bounded by :attr:`Settings.IMAGE_CACHE_SIZE` bytes.
+"""
+
+import asyncio
+import collections
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, Tuple
+
+from .client import OrchestratorClient, get_client
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+#: Path where :attr:`ImageCache.directory` is served
+ROUTE = "/results"
+
+THUMBNAIL_SUFFIX = ".thumb"
+
+
+class ImageCache:
+    """
+    Content-addressed, size-bounded image cache on disk.
+
+    :param directory: Where images and thumbnails are stored
+    :param max_bytes: Maximum total size of the cached files
+    :param thumbnail_size: Maximum width and height of thumbnails in pixels
+    :param client: Client to use, defaults to the shared :func:`.client.get_client`
+    """
+
+    def __init__(self, directory: str = settings.IMAGE_CACHE_DIR, max_bytes: int = settings.IMAGE_CACHE_SIZE,
+                 thumbnail_size: int = settings.IMAGE_THUMBNAIL_SIZE, client: OrchestratorClient | None = None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.client = client or get_client()
+
+        # Image and thumbnail names, and their total size, by content hash, least recently used first
+        self._entries: collections.OrderedDict[str, Tuple[str, str, int]] = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the cached files in bytes.
+        """
+        return self._size
+
+    def _scan(self):
+        """
+        Pick up images cached by earlier runs, oldest first.
+        """
+        files: Dict[str, Dict[str, os.DirEntry]] = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                digest = entry.name.split(".")[0]
+                kind = "thumbnail" if THUMBNAIL_SUFFIX in entry.name else "image"
+                files.setdefault(digest, {})[kind] = entry
+
+        for digest, entries in sorted(files.items(), key=lambda item: max(e.stat().st_mtime for e in item[1].values())):
+            image = entries.get("image")
+            thumbnail = entries.get("thumbnail", image)
+            if image is None:
+                os.unlink(thumbnail.path)
+                continue
+            size = image.stat().st_size + (thumbnail.stat().st_size if thumbnail is not image else 0)
+            self._entries[digest] = (image.name, thumbnail.name, size)
+            self._size += size
+        self._evict()
+
+    def url(self, name: str) -> str:
+        return f"{settings.DEMO_URL}{ROUTE}/{name}"
+
+    async def fetch(self, url: str) -> Tuple[str, str]:
+        """
+        Download image from :param:`url` and cache it.
+
+        :return: URLs of the cached image and its thumbnail
+        """
+        res = await self.client.aget(url, endpoint="image")
+        res.raise_for_status()
+        image, thumbnail = await asyncio.to_thread(self.store, res.content, res.headers.get("Content-Type", ""))
+        return self.url(image), self.url(thumbnail)
+
+    def submit(self, url: str) -> Future[Tuple[str, str]]:
+        """
+        Schedule :meth:`fetch` on the client event loop.
+        """
+        return self.client.submit(self.fetch(url))
+
+    def store(self, content: bytes, content_type: str = "") -> Tuple[str, str]:
+        """
+        Store image, unless already cached, and make its thumbnail.
+
+        :return: File names of the image and its thumbnail
+        """
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        with self._lock:
+            if (entry := self._entries.get(digest)) is not None:
+                self._entries.move_to_end(digest)
+                return entry[0], entry[1]
+
+        ext = _extension(content_type)
+        image = f"{digest}{ext}"
+        _write(self.directory / image, content)
+
+        thumbnail = image
+        size = len(content)
+        try:
+            if thumbnail_content := self._thumbnail(content):
+                thumbnail = f"{digest}{THUMBNAIL_SUFFIX}{ext}"
+                _write(self.directory / thumbnail, thumbnail_content)
+                size += len(thumbnail_content)
+        except Exception as e:
+            logger.warning("Could not make thumbnail of %s: %s", image, e)
+
+        with self._lock:
+            if digest not in self._entries:
+                self._entries[digest] = (image, thumbnail, size)
+                self._size += size
+                self._evict()
+        return image, thumbnail
+
+    def _thumbnail(self, content: bytes) -> bytes | None:
+        """
+        Scale image down to :attr:`thumbnail_size`.
+
+        :return: Thumbnail, or ``None`` if the image is small enough already
+        """
+        # Pillow is a dependency of gradio, but slow to import
+        from PIL import Image
+
+        with Image.open(io.BytesIO(content)) as img:
+            if max(img.size) <= self.thumbnail_size:
+                return None
+            img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+            out = io.BytesIO()
+            img.save(out, format=img.format or "JPEG")
+            return out.getvalue()
+
+    def _evict(self):
+        """
+        Remove least recently used files until the cache fits :attr:`max_bytes`. Keeps the latest image.
+        """
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            digest, (image, thumbnail, size) = self._entries.popitem(last=False)
+            self._size -= size
+            for name in {image, thumbnail}:
+                try:
+                    os.unlink(self.directory / name)
+                except FileNotFoundError:
+                    pass
+            logger.debug("Evicted %s from image cache", image)
+
+
+def _extension(content_type: str) -> str:
+    return {
+        "image/png": ".png",
+        "image/gif": ".gif",
+        "image/webp": ".webp",
+    }.get(content_type.split(";")[0].strip(), ".jpeg")
+
+
+def _write(path: Path, content: bytes):
+    """
+    Write atomically, so a file is never served half-written.
+    """
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+_cache: ImageCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """
+    Get the shared :class:`ImageCache`.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+    return _cache
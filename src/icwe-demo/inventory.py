@@ -0,0 +1,125 @@
+"""
+Orchestrator inventory cache
+============================
+
+Keeps modules and deployments up to date without a restart.
+
+:class:`InventoryCache` fetches orchestrator listings with conditional requests (``If-None-Match`` and
+``If-Modified-Since``), and falls back to comparing content hashes when the orchestrator doesn't support them, so
+unchanged listings are not parsed or applied again. Every applied change bumps :attr:`InventoryCache.version`, so
+that the UI re-renders the module dropdowns only when something has changed.
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from .client import OrchestratorClient, get_client
+from .log_buffer import ChangeNotifier
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InventoryCache:
+    """
+    Change detection and scheduled refresh for orchestrator listings.
+
+    :param interval: Seconds between refreshes
+    :param client: Client to use, defaults to the shared :func:`.client.get_client`
+    """
+
+    def __init__(self, interval: float = settings.INVENTORY_REFRESH_INTERVAL, client: OrchestratorClient | None = None):
+        self.interval = interval
+        self.client = client or get_client()
+
+        #: Incremented on every applied change
+        self.version = 0
+
+        #: Notified when :attr:`version` changes
+        self.updates = ChangeNotifier()
+
+        # ETag, Last-Modified and content hash by URL
+        self._validators: Dict[str, Tuple[str | None, str | None, bytes]] = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    async def fetch(self, url: str, *, endpoint: str) -> Any | None:
+        """
+        Fetch JSON listing from :param:`url`.
+
+        :return: Parsed listing, or ``None`` if it hasn't changed since the last fetch
+        """
+        headers = {}
+        etag, last_modified, digest = self._validators.get(url, (None, None, b""))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        res = await self.client.aget(url, endpoint=endpoint, headers=headers)
+        if res.status_code == 304:
+            logger.debug("%s not modified", url)
+            return None
+        res.raise_for_status()
+
+        new_digest = hashlib.blake2b(res.content, digest_size=16).digest()
+        self._validators[url] = (res.headers.get("ETag"), res.headers.get("Last-Modified"), new_digest)
+        if new_digest == digest:
+            logger.debug("%s unchanged", url)
+            return None
+
+        return res.json()
+
+    def changed(self):
+        """
+        Announce that the inventory has changed.
+        """
+        self.version += 1
+        self.updates.notify()
+
+    def run(self, refresh: Callable[[], Any]):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            try:
+                refresh()
+            except Exception as e:
+                logger.error("Error refreshing inventory: %s", e, exc_info=True)
+
+    def start(self, refresh: Callable[[], Any]):
+        """
+        Call :param:`refresh` every :attr:`interval` seconds in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, args=(refresh,), name="inventory", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """
+        Refresh without waiting for the interval.
+        """
+        self._wakeup.set()
+
+
+_inventory: InventoryCache | None = None
+_inventory_lock = threading.Lock()
+
+
+def get_inventory() -> InventoryCache:
+    """
+    Get the shared :class:`InventoryCache`.
+    """
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = InventoryCache()
+    return _inventory
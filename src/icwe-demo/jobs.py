@@ -0,0 +1,227 @@
+"""
+Deployment jobs
+===============
+
+Deploy and run actions as asynchronous jobs.
+
+A :class:`Job` performs one or more actions, like ``("deploy", "run")``, on a deployment, one after the other without
+waiting for the UI in between. Jobs run as coroutines on the event loop of :mod:`.client`, so a slow device only holds
+up its own job, not a thread. Jobs of the same deployment are queued, jobs of different deployments run concurrently.
+
+Each job tracks the stage of every device of the deployment, and reports stage changes to the ``progress`` callback of
+:class:`JobEngine` as they happen. The orchestrator answers for all devices at once, so devices that report on their
+own, like in their logs, can be advanced earlier with :meth:`JobEngine.device_reported`.
+
+Deploying a solution that is already on its devices is skipped, see :mod:`.deployed`.
+"""
+
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Tuple
+
+from . import log_ingest
+from ._typing import Deployment, DeploymentID, DeviceID
+from .client import OrchestratorClient, get_client
+from .deployed import get_deployed_state
+from .settings import settings
+from .utils import ado_deployment, arun_deployment
+
+logger = logging.getLogger(__name__)
+
+#: Stage of a device in a job
+PENDING = "pending"
+DEPLOYING = "deploying"
+DEPLOYED = "deployed"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+#: Actions by name, with the stages of the devices while and after the action runs
+ACTIONS = {
+    "deploy": (ado_deployment, DEPLOYING, DEPLOYED),
+    "run": (arun_deployment, RUNNING, DONE),
+}
+
+# Stage of a device while the action ending in a stage runs
+_RUNNING_STAGES = {done_stage: running_stage for _, running_stage, done_stage in ACTIONS.values()}
+
+_job_ids = itertools.count(1)
+
+
+class Job:
+    """
+    Actions on a single deployment.
+
+    :param deployment: Deployment to act on
+    :param actions: Names of :data:`ACTIONS`, run in order
+    """
+
+    def __init__(self, deployment: Deployment, actions: Tuple[str, ...]):
+        for action in actions:
+            if action not in ACTIONS:
+                raise ValueError(f"Unknown action {action!r}, expected one of {', '.join(ACTIONS)}")
+
+        self.id = next(_job_ids)
+        self.deployment = deployment
+        self.actions = actions
+        self.stages: Dict[DeviceID, str] = dict.fromkeys((step['device'] for step in deployment['sequence']), PENDING)
+        self.error: BaseException | None = None
+        #: Actions skipped, as the solution was already deployed
+        self.skipped: list[str] = []
+        self.created = time.time()
+        self.finished: float | None = None
+        self.future: Future | None = None
+
+    def __repr__(self):
+        return f"<Job {self.id} {'+'.join(self.actions)} {self.deployment['name']!r}>"
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def result(self, timeout: float | None = None):
+        """
+        Wait for the job to finish, and raise its error if it failed.
+        """
+        return self.future.result(timeout)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "deployment": self.deployment['_id'],
+            "actions": list(self.actions),
+            "stages": dict(self.stages),
+            "error": str(self.error) if self.error else None,
+            "skipped": list(self.skipped),
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+ProgressCallback = Callable[[Job, DeviceID, str], None]
+
+
+class JobEngine:
+    """
+    Run :class:`Job` on the client event loop.
+
+    :param progress: Called with the job, device and new stage on every stage change
+    :param history: Number of finished jobs kept in :attr:`jobs`
+    :param client: Client whose event loop is used, defaults to the shared :func:`.client.get_client`
+    """
+
+    def __init__(self, progress: ProgressCallback | None = None, history: int = 32,
+                 client: OrchestratorClient | None = None):
+        self.progress = progress
+        self.history = history
+        self.client = client or get_client()
+        self.jobs: collections.OrderedDict[int, Job] = collections.OrderedDict()
+        # Only used on the client event loop
+        self._locks: Dict[DeploymentID, asyncio.Lock] = {}
+
+    def submit(self, deployment: Deployment, *actions: str) -> Job:
+        """
+        Start job for :param:`actions` on :param:`deployment`.
+        """
+        job = Job(deployment, actions)
+        self.jobs[job.id] = job
+        self._trim()
+        job.future = self.client.submit(self._run(job))
+        logger.debug("Submitted %r", job)
+        return job
+
+    def running(self) -> list[Job]:
+        return [job for job in list(self.jobs.values()) if not job.done]
+
+    def device_reported(self, device: DeviceID, stage: str):
+        """
+        Advance :param:`device` to :param:`stage` in its running jobs, before the orchestrator has answered.
+
+        Device reports don't name the deployment, so only jobs where the device is in the action that ends in
+        :param:`stage` are advanced, like ``deploying`` for ``deployed``. The deploy cache is only updated if a
+        single job is deploying to the device.
+        """
+        if (running_stage := _RUNNING_STAGES.get(stage)) is None:
+            raise ValueError(f"Unknown reported stage {stage!r}, expected one of {', '.join(_RUNNING_STAGES)}")
+
+        jobs = [job for job in self.running() if job.stages.get(device) == running_stage]
+        if stage == DEPLOYED and len(jobs) == 1:
+            get_deployed_state().record(jobs[0].deployment, [device])
+        for job in jobs:
+            self._set_stage(job, [device], stage)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in list(self.jobs.items()) if job.done]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            self.jobs.pop(job_id, None)
+
+    def _set_stage(self, job: Job, devices, stage: str):
+        for device in devices:
+            if job.stages.get(device) == stage:
+                continue
+            job.stages[device] = stage
+            if self.progress is not None:
+                try:
+                    self.progress(job, device, stage)
+                except Exception as e:
+                    logger.error("Error reporting progress of %r: %s", job, e, exc_info=True)
+
+    async def _run(self, job: Job):
+        lock = self._locks.setdefault(job.deployment['_id'], asyncio.Lock())
+        try:
+            async with lock:
+                with log_ingest.active():
+                    for action in job.actions:
+                        await self._run_action(job, action)
+        except BaseException as e:
+            job.error = e
+            self._set_stage(job, [device for device, stage in job.stages.items() if stage != DONE], FAILED)
+            raise
+        finally:
+            job.finished = time.time()
+            logger.debug("Finished %r in %.2f s", job, job.finished - job.created)
+
+    async def _run_action(self, job: Job, action: str):
+        func, running_stage, done_stage = ACTIONS[action]
+        deployed = get_deployed_state()
+        if action == "deploy" and settings.DEPLOY_CACHE and deployed.is_deployed(job.deployment):
+            logger.info("Solution %s is already deployed, skipping", job.deployment['name'])
+            job.skipped.append(action)
+            self._set_stage(job, list(job.stages), done_stage)
+            return
+
+        self._set_stage(job, list(job.stages), running_stage)
+        try:
+            await func(job.deployment)
+        except BaseException:
+            if action == "deploy":
+                # Devices may have been left in any state
+                for device in job.stages:
+                    deployed.forget(device)
+            raise
+
+        if action == "deploy":
+            deployed.record(job.deployment)
+        self._set_stage(job, list(job.stages), done_stage)
+
+
+_engine: JobEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> JobEngine:
+    """
+    Get the shared :class:`JobEngine`.
+
+    Set :attr:`JobEngine.progress` to receive stage changes.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = JobEngine()
+    return _engine
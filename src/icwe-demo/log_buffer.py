@@ -0,0 +1,158 @@
+"""
+Rendered log buffers
+====================
+
+Per-device buffers of rendered log lines. Each buffer has a version counter that is bumped on every change, and caches
+its joined text, so readers can skip work when nothing has changed.
+
+:class:`Coalescer` collapses runs of repeated messages into one counted line, so bursts of identical messages don't
+push everything else out of the buffers.
+
+:class:`ChangeNotifier` lets async readers, like the log streams pushed to the browsers, sleep until a writer thread
+announces a change.
+"""
+
+import asyncio
+import collections
+import threading
+from typing import Callable, Dict, Hashable, Iterator, Set, Tuple
+
+
+class LogBuffer:
+    """
+    Bounded buffer of rendered log lines.
+
+    :param maxlen: Maximum number of lines kept
+    """
+
+    def __init__(self, maxlen: int = 100):
+        self._lines = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._text = ""
+        self._text_version = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._lines))
+
+    def append(self, line: str):
+        with self._lock:
+            self._lines.append(line)
+            self.version += 1
+
+    def replace_last(self, line: str):
+        """
+        Replace the last line, or append if the buffer is empty.
+        """
+        with self._lock:
+            if self._lines:
+                self._lines[-1] = line
+            else:
+                self._lines.append(line)
+            self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+            self.version += 1
+
+    def render(self) -> str:
+        """
+        Lines joined with newlines. Joined only when the buffer has changed since the last call.
+        """
+        if self._text_version == self.version:
+            return self._text
+
+        with self._lock:
+            self._text = "\n".join(self._lines)
+            self._text_version = self.version
+            return self._text
+
+
+class Coalescer:
+    """
+    Count repeats of the same message within a time window.
+
+    :param window: Seconds from the first message of a run during which repeats are collapsed. ``0`` disables.
+    """
+
+    def __init__(self, window: float = 5.):
+        self.window = window
+        # Message, timestamp of the first message and count of the current run, by key
+        self._runs: Dict[Hashable, Tuple[str, float, int]] = {}
+
+    def add(self, key: Hashable, message: str, timestamp: float) -> int:
+        """
+        Add message to the run of :param:`key`, like a device.
+
+        :return: Number of messages in the run, ``1`` if the message starts a new run
+        """
+        run = self._runs.get(key)
+        if run is not None and run[0] == message and timestamp - run[1] <= self.window:
+            count = run[2] + 1
+            self._runs[key] = (message, run[1], count)
+            return count
+
+        self._runs[key] = (message, timestamp, 1)
+        return 1
+
+    def reset(self, key: Hashable | None = None):
+        """
+        End the run of :param:`key`, or all runs.
+        """
+        if key is None:
+            self._runs.clear()
+        else:
+            self._runs.pop(key, None)
+
+
+class ChangeNotifier:
+    """
+    Wake up async waiters from any thread.
+    """
+
+    def __init__(self):
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = set()
+        self._lock = threading.Lock()
+
+    async def wait(self, timeout: float | None = None, predicate: Callable[[], bool] | None = None) -> bool:
+        """
+        Wait for :meth:`notify`.
+
+        :param predicate: Return immediately if true. Checked after registering as a waiter, so a notification
+            between checking and waiting is not lost.
+        :return: ``False`` if timed out
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            if predicate is not None and predicate():
+                return True
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def notify(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_done, future)
+            except RuntimeError:
+                # Loop is closed, nobody is waiting anymore
+                pass
+
+
+def _set_done(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,308 @@
+"""
+Log ingest backends
+===================
+
+Backends for pulling device logs from the orchestrator into :data:`SETUP.logs_queue`.
+
+- :class:`PollingIngest` polls the logging endpoint with an adaptive delay: tight polling while a deployment is
+  running, exponential backoff while idle.
+- :class:`LongPollIngest` asks the server to hold the request until logs are available. Servers that don't support
+  it answer immediately, and the polling backoff applies.
+- :class:`StreamingIngest` keeps a single request open and reads server-sent events or chunked JSON lines. If the
+  server answers with a plain JSON list, it falls back to long-polling.
+
+Deployment actions should be wrapped in :func:`active` so that the pollers tighten their interval while the devices
+are busy.
+
+All backends take a ``backpressure`` callback, like :meth:`.log_queue.LogQueue.wait_for_space`. Pollers call it before
+fetching, so logs accumulate on the orchestrator and are fetched as one batch once the consumer has caught up. Streams
+call it before reading the next event, which leaves the rest of the stream in the socket buffers.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+import httpx
+
+from . import metrics
+from .client import OrchestratorClient, get_client
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+LogSink = Callable[[dict], None]
+
+# Called with a timeout, returns ``False`` while the consumer is still behind
+Backpressure = Callable[[float], bool]
+
+INGEST_BATCH_SIZE = metrics.Histogram("icwe_log_ingest_batch_size", "Logs received per response or event",
+                                      buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000))
+INGEST_LOGS = metrics.Counter("icwe_log_ingest_logs_total", "Logs received from the orchestrator")
+INGEST_THROTTLED = metrics.Counter("icwe_log_ingest_throttled_seconds_total",
+                                   "Seconds log pulling was held back by backpressure")
+
+_active_lock = threading.Lock()
+_active_count = 0
+_active_until = 0.
+
+# Set when an action starts, so idle pollers don't sleep through the backoff.
+_wakeup = threading.Event()
+
+
+@contextlib.contextmanager
+def active():
+    """
+    Mark a deployment action as running.
+
+    While any action is running, and for :attr:`Settings.LOG_ACTIVE_LINGER` seconds after, the log pollers use
+    :attr:`Settings.LOG_PULL_ACTIVE_DELAY` between pulls.
+    """
+    global _active_count, _active_until
+    with _active_lock:
+        _active_count += 1
+    _wakeup.set()
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active_count -= 1
+            _active_until = time.monotonic() + settings.LOG_ACTIVE_LINGER
+
+
+def is_active() -> bool:
+    return _active_count > 0 or time.monotonic() < _active_until
+
+
+class LogIngest:
+    """
+    Base class for log ingest backends.
+
+    :param url: Orchestrator logging endpoint
+    :param sink: Called with every received log entry
+    :param client: Client to use, defaults to the shared :func:`.client.get_client`
+    :param backpressure: Wait for the consumer before pulling more logs
+    """
+
+    def __init__(self, url: str, sink: LogSink, client: OrchestratorClient | None = None,
+                 backpressure: Backpressure | None = None):
+        if not url:
+            raise ValueError("Orchestrator URL is not set, please set WASMIOT_LOGGING_ENDPOINT environment variable")
+
+        self.url = url
+        self.sink = sink
+        self.logs_after = datetime.datetime.now(datetime.UTC)
+        self.client = client or get_client()
+        self.backpressure = backpressure
+        self._stop = threading.Event()
+
+    def run(self):
+        """
+        Pull logs until :meth:`stop` is called.
+        """
+        logger.debug("Pulling logs with %s from %s", type(self).__name__, self.url)
+        while not self._stop.is_set():
+            self.step()
+
+    def step(self):
+        raise NotImplementedError
+
+    def stop(self):
+        self._stop.set()
+        _wakeup.set()
+
+    def throttle(self):
+        """
+        Wait while the consumer is behind.
+        """
+        if self.backpressure is None or self.backpressure(0):
+            return
+
+        started = time.monotonic()
+        while not self._stop.is_set() and not self.backpressure(1.):
+            pass
+        waited = time.monotonic() - started
+        INGEST_THROTTLED.inc(waited)
+        logger.debug("Log pulling held back for %.1f s by backpressure", waited)
+
+    def deliver(self, logs: Iterable[dict]) -> int:
+        """
+        Pass logs to the sink and advance :attr:`logs_after`.
+
+        :return: Number of logs delivered
+        """
+        count = 0
+        for log in logs:
+            self.sink(log)
+            count += 1
+            if received := log.get('dateReceived'):
+                self.logs_after = datetime.datetime.fromisoformat(received)
+        INGEST_BATCH_SIZE.observe(count)
+        INGEST_LOGS.inc(count)
+        return count
+
+
+class PollingIngest(LogIngest):
+    """
+    Poll the logging endpoint with an adaptive delay.
+
+    Delay starts from :attr:`Settings.LOG_PULL_DELAY` and doubles on every empty response up to
+    :attr:`Settings.LOG_PULL_MAX_DELAY`. Receiving logs resets it.
+    """
+
+    def __init__(self, url: str, sink: LogSink,
+                 min_delay: float = settings.LOG_PULL_DELAY,
+                 max_delay: float = settings.LOG_PULL_MAX_DELAY,
+                 active_delay: float = settings.LOG_PULL_ACTIVE_DELAY,
+                 client: OrchestratorClient | None = None,
+                 backpressure: Backpressure | None = None):
+        super().__init__(url, sink, client=client, backpressure=backpressure)
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.active_delay = active_delay
+        self.delay = min_delay
+
+    def params(self) -> dict:
+        return {"after": self.logs_after.isoformat()}
+
+    def request_timeout(self) -> float:
+        return 10.
+
+    def step(self):
+        self.throttle()
+        _wakeup.clear()
+        try:
+            res = self.client.get(self.url, params=self.params(), endpoint="logs", timeout=self.request_timeout())
+            res.raise_for_status()
+            received = self.deliver(res.json())
+        except Exception as e:
+            logger.error("Error pulling logs: %s", e, exc_info=True)
+            received = 0
+
+        if received:
+            logger.debug("Received %d logs, next after %s", received, self.logs_after)
+            self.delay = self.min_delay
+        else:
+            self.delay = min(self.delay * 2, self.max_delay)
+
+        self.sleep()
+
+    def sleep(self):
+        delay = self.active_delay if is_active() else self.delay
+        _wakeup.wait(delay)
+
+
+class LongPollIngest(PollingIngest):
+    """
+    Long-poll the logging endpoint.
+
+    The ``wait`` parameter asks the server to hold the request for up to :attr:`Settings.LOG_LONGPOLL_TIMEOUT`
+    seconds until new logs are available.
+    """
+
+    def __init__(self, url: str, sink: LogSink, wait: float = settings.LOG_LONGPOLL_TIMEOUT, **kwargs):
+        super().__init__(url, sink, **kwargs)
+        self.wait = wait
+
+    def params(self) -> dict:
+        return {**super().params(), "wait": self.wait}
+
+    def request_timeout(self) -> float:
+        return self.wait + 5.
+
+    def step(self):
+        started = time.monotonic()
+        super().step()
+        if time.monotonic() - started >= self.wait / 2:
+            # Server held the request, so it supports long-polling. No need to back off.
+            self.delay = self.min_delay
+
+    def sleep(self):
+        if self.delay == self.min_delay:
+            # Logs were received, or the server held the request; ask again right away.
+            return
+        super().sleep()
+
+
+class StreamingIngest(LongPollIngest):
+    """
+    Read logs from a server-sent events or chunked JSON lines stream.
+
+    The stream is reopened from :attr:`logs_after` when the connection drops. If the server does not stream, falls
+    back to long-polling.
+    """
+
+    STREAM_TYPES = ("text/event-stream", "application/x-ndjson")
+
+    def __init__(self, url: str, sink: LogSink, **kwargs):
+        super().__init__(url, sink, **kwargs)
+        self.streaming = True
+
+    def step(self):
+        if not self.streaming:
+            return super().step()
+
+        stream = self.client.stream_lines(self.url,
+                                          params={**self.params(), "stream": "true"},
+                                          headers={"Accept": ", ".join(self.STREAM_TYPES)},
+                                          timeout=httpx.Timeout(self.wait + 5., connect=5.),
+                                          endpoint="logs")
+        try:
+            res = next(stream)
+            res.raise_for_status()
+            content_type = res.headers.get("Content-Type", "").split(";")[0].strip()
+            if content_type not in self.STREAM_TYPES:
+                logger.info("Logging endpoint does not stream (%s), falling back to long-polling", content_type)
+                self.streaming = False
+                self.deliver(json.loads("".join(stream)))
+                return
+
+            events = self._sse_events(stream) if content_type == "text/event-stream" else stream
+            for data in events:
+                if self._stop.is_set():
+                    break
+                if not data:
+                    continue
+                self.throttle()
+                payload = json.loads(data)
+                self.deliver(payload if isinstance(payload, list) else [payload])
+        except Exception as e:
+            logger.error("Log stream interrupted: %s", e, exc_info=True)
+            _wakeup.wait(self.min_delay)
+        finally:
+            stream.close()
+
+    @staticmethod
+    def _sse_events(lines: Iterable[str]) -> Iterator[str]:
+        """
+        Join ``data:`` lines of server-sent events. Comments and other fields are ignored.
+        """
+        data = []
+        for line in lines:
+            if line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            elif not line and data:
+                yield "\n".join(data)
+                data = []
+
+
+INGEST_MODES: dict[str, type[LogIngest]] = {
+    "poll": PollingIngest,
+    "longpoll": LongPollIngest,
+    "stream": StreamingIngest,
+}
+
+
+def create_ingest(url: str, sink: LogSink, mode: str = settings.LOG_INGEST_MODE, **kwargs) -> LogIngest:
+    """
+    Create log ingest backend by :attr:`Settings.LOG_INGEST_MODE`.
+    """
+    try:
+        cls = INGEST_MODES[mode]
+    except KeyError as e:
+        raise ValueError(f"Unknown log ingest mode {mode!r}, expected one of {', '.join(INGEST_MODES)}") from e
+    return cls(url, sink, **kwargs)
@@ -0,0 +1,150 @@
+"""
+Log queue
+=========
+
+Bounded queue between log ingest and log parsing, see :data:`SETUP.logs_queue`.
+
+The pipeline has three stages, each with its own capacity:
+
+1. Ingest: :mod:`.log_ingest` puts received logs into :class:`LogQueue`. When the queue fills up, the puller waits for
+   the parser instead of fetching more, so unread logs stay on the orchestrator and are fetched later as one batch.
+2. Parse: :func:`.ui.parse_logs` takes logs from the queue in batches of :attr:`Settings.LOG_PARSE_BATCH`.
+3. Render: parsed lines are kept in per-device :class:`.log_buffer.LogBuffer` of :attr:`Settings.LOG_HISTORY_LENGTH`
+   lines.
+
+If the queue is still full after waiting, the oldest log is dropped. Drops are counted per device in
+:class:`DeviceLogStats`, so that lost logs can be reported instead of disappearing silently.
+"""
+
+import collections
+import threading
+from typing import Counter, Deque, Dict, List
+
+from .log_record import LogRecord
+
+
+class DeviceLogStats:
+    """
+    Log counters of a single device.
+    """
+
+    __slots__ = ("received", "dropped", "coalesced")
+
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+class LogQueue:
+    """
+    Bounded, thread-safe queue of log entries with backpressure and drop accounting.
+
+    :param capacity: Maximum number of logs waiting to be parsed
+    :param low_watermark: Fraction of :param:`capacity` the queue must drain to before the puller continues
+    """
+
+    def __init__(self, capacity: int = 256, low_watermark: float = .5):
+        self.capacity = capacity
+        self.low_watermark = int(capacity * low_watermark)
+        self._logs: Deque[LogRecord] = collections.deque()
+        self._cond = threading.Condition()
+        self._stats: Dict[str, DeviceLogStats] = {}
+        self._unreported: Counter[str] = collections.Counter()
+
+        #: Set when logs are added
+        self.ready = threading.Event()
+
+    def __len__(self):
+        return len(self._logs)
+
+    def __bool__(self):
+        return bool(self._logs)
+
+    @property
+    def pressure(self) -> float:
+        """
+        How full the queue is, from 0 to 1.
+        """
+        return len(self._logs) / self.capacity
+
+    def stats(self, device: str) -> DeviceLogStats:
+        """
+        Counters of :param:`device`, created on first use.
+        """
+        if (stats := self._stats.get(device)) is None:
+            stats = self._stats.setdefault(device, DeviceLogStats())
+        return stats
+
+    def put(self, log: LogRecord, timeout: float | None = 0) -> bool:
+        """
+        Add log to the queue.
+
+        :param timeout: Seconds to wait for the parser if the queue is full, before dropping the oldest log. ``None``
+            waits indefinitely. Callers that must not block, like :func:`.utils.device_log`, use ``0``.
+        :return: ``False`` if a log was dropped to make room
+        """
+        with self._cond:
+            self.stats(log.device).received += 1
+            if len(self._logs) >= self.capacity and timeout != 0:
+                self._cond.wait_for(lambda: len(self._logs) < self.capacity, timeout)
+
+            dropped = len(self._logs) >= self.capacity
+            if dropped:
+                oldest = self._logs.popleft()
+                self.stats(oldest.device).dropped += 1
+                self._unreported[oldest.device] += 1
+            self._logs.append(log)
+        self.ready.set()
+        return not dropped
+
+    def get_batch(self, limit: int | None = None) -> List[LogRecord]:
+        """
+        Take up to :param:`limit` logs from the queue.
+        """
+        with self._cond:
+            count = len(self._logs) if limit is None else min(limit, len(self._logs))
+            batch = [self._logs.popleft() for _ in range(count)]
+            if batch:
+                self._cond.notify_all()
+        return batch
+
+    def wait_for_space(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the queue has drained to the low watermark.
+
+        :return: ``False`` if timed out
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._logs) <= self.low_watermark, timeout)
+
+    def take_dropped(self) -> Dict[str, int]:
+        """
+        Number of logs dropped per device since the last call.
+        """
+        with self._cond:
+            dropped, self._unreported = dict(self._unreported), collections.Counter()
+        return dropped
+
+    def clear(self):
+        """
+        Drop all queued logs. They are not counted as dropped.
+        """
+        with self._cond:
+            self._logs.clear()
+            self._unreported.clear()
+            self._cond.notify_all()
+        self.ready.clear()
+
+    def stats_dict(self) -> Dict[str, dict]:
+        """
+        Counters of all devices.
+        """
+        return {device: stats.as_dict() for device, stats in list(self._stats.items())}
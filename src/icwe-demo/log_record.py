@@ -0,0 +1,111 @@
+"""
+Log records
+===========
+
+Compact representation of device logs, from ingest to the log view.
+
+Orchestrator logs arrive as JSON dicts. :meth:`LogRecord.from_json` converts each one once, when it is received: the
+device name is interned and resolved to its index in :data:`.SETUP.DEVICES`, and timestamps are parsed to integer
+milliseconds since epoch. Later stages only read attributes, and times are formatted when a line is rendered.
+
+Rules of :mod:`.log_rules` don't rewrite the message, they set :attr:`LogRecord.emoji`, which :attr:`LogRecord.text`
+prefixes to the message.
+"""
+
+import datetime
+import functools
+import sys
+import time
+from typing import Mapping
+
+
+class LogRecord:
+    """
+    Device log entry.
+
+    :param device: Device name
+    :param idx: Index of the device in :data:`.SETUP.DEVICES`
+    :param time: Time the device logged the entry, in milliseconds since epoch
+    :param received: Time the orchestrator received the entry, in milliseconds since epoch
+    :param ingested: Time the demo received the entry, in milliseconds since epoch
+    """
+
+    __slots__ = ("device", "idx", "time", "received", "ingested", "level", "module", "message", "emoji")
+
+    def __init__(self, device: str, idx: int, time: int, message: str, level: str | None = None,
+                 module: str | None = None, received: int | None = None, ingested: int | None = None):
+        self.device = device
+        self.idx = idx
+        self.time = time
+        self.message = message
+        self.level = level
+        self.module = module
+        self.received = received
+        self.ingested = ingested
+        #: Set by the matching rule of :mod:`.log_rules`
+        self.emoji: str | None = None
+
+    @classmethod
+    def from_json(cls, log: dict, device_index: Mapping[str, int]) -> "LogRecord | None":
+        """
+        Convert orchestrator log entry.
+
+        :return: Record, or ``None`` if the device is not in :param:`device_index`
+        """
+        if (idx := device_index.get(log['deviceName'])) is None:
+            return None
+        now = now_ms()
+        received = epoch_ms(log.get('dateReceived'))
+        level = log.get('loglevel')
+        module = log.get('module_name')
+        return cls(
+            sys.intern(log['deviceName']),
+            idx,
+            epoch_ms(log.get('timestamp')) or received or now,
+            log['message'],
+            level=sys.intern(level) if level else None,
+            module=sys.intern(module) if module else None,
+            received=received,
+            ingested=now,
+        )
+
+    @property
+    def text(self) -> str:
+        """
+        Message with the emoji of its rule.
+        """
+        return f"{self.emoji} {self.message}" if self.emoji else self.message
+
+    def __repr__(self):
+        return f"LogRecord({self.device!r}, {self.time}, {self.message!r})"
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def epoch_ms(timestamp: str | None) -> int | None:
+    """
+    Parse ISO timestamp as milliseconds since epoch, or ``None`` if missing or invalid.
+    """
+    if not timestamp:
+        return None
+    try:
+        return round(datetime.datetime.fromisoformat(timestamp).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=64)
+def _format_second(second: int) -> str:
+    return time.strftime("%H:%M:%S", time.localtime(second))
+
+
+def format_ms(ms: int) -> str:
+    """
+    Format time as local time with milliseconds.
+
+    Consecutive logs mostly fall in the same second, so the formatted seconds are cached.
+    """
+    second, millis = divmod(ms, 1000)
+    return f"{_format_second(second)}.{millis:03d}"
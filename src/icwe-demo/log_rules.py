@@ -0,0 +1,152 @@
+"""
+Log message rules
+=================
+
+Declarative rules for classifying device log messages.
+
+Rules are registered with :meth:`RuleSet.exact` for fixed messages and :meth:`RuleSet.pattern` for regular
+expressions. Patterns are compiled into a single alternation, so a message is classified with one dictionary lookup
+and at most one regex scan, regardless of how many rules there are. Rules are tried in order of registration, like
+an if/elif chain.
+
+Repeats of a message may be collapsed into one counted line, see :class:`.log_buffer.Coalescer`. Rules whose handlers
+must see every message, like results, are registered with ``collapse=False``.
+
+Example::
+
+    rules = RuleSet()
+
+    @rules.pattern(r"Result url: (?P<url>.+)", emoji="📷")
+    def on_result(idx, log, match):
+        device_event(idx, (match['url'], log.text))
+"""
+
+import re
+from typing import Callable, Dict, List, Mapping, NamedTuple, Tuple
+
+from .log_record import LogRecord
+
+# Handler is called with device index, the log entry and the named groups of the match.
+RuleHandler = Callable[[int, LogRecord, Mapping[str, str]], None]
+
+_GROUP_NAME = re.compile(r"\(\?P<(?P<name>\w+)>")
+_GROUP_REF = re.compile(r"\(\?P=(?P<name>\w+)\)")
+
+
+class Rule(NamedTuple):
+    name: str
+    emoji: str | None
+    handler: RuleHandler | None
+    groups: Tuple[Tuple[str, str], ...]
+    collapse: bool = True
+
+
+class RuleSet:
+    """
+    Ordered set of log message rules.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Rule] = {}
+        self._patterns: List[Tuple[str, Rule]] = []
+        self._default: RuleHandler | None = None
+        self._compiled: re.Pattern | None = None
+        self._rules: Dict[str, Rule] = {}
+
+    def exact(self, message: str, emoji: str | None = None, collapse: bool = True):
+        """
+        Register rule for messages equal to :param:`message`. Can be used as a decorator to set the handler.
+
+        Exact rules are checked before patterns.
+
+        :param collapse: Whether repeats of the message may be collapsed instead of handled
+        """
+        self._exact[message] = Rule(message, emoji, None, (), collapse)
+
+        def _register(handler: RuleHandler):
+            self._exact[message] = self._exact[message]._replace(handler=handler)
+            return handler
+        return _register
+
+    def pattern(self, pattern: str | re.Pattern, emoji: str | None = None, collapse: bool = True):
+        """
+        Register rule for messages matching :param:`pattern` from the start. Can be used as a decorator to set the
+        handler.
+
+        Named groups of the pattern are passed to the handler.
+
+        :param collapse: Whether repeats of matching messages may be collapsed instead of handled
+        """
+        if isinstance(pattern, re.Pattern):
+            pattern = pattern.pattern
+
+        name = f"r{len(self._patterns)}"
+        # Prefix group names, so that rules can use the same group names in the combined pattern.
+        groups = tuple((f"{name}_{group}", group) for group in _GROUP_NAME.findall(pattern))
+        prefixed = _GROUP_NAME.sub(lambda m: f"(?P<{name}_{m['name']}>", pattern)
+        prefixed = _GROUP_REF.sub(lambda m: f"(?P={name}_{m['name']})", prefixed)
+        re.compile(prefixed)  # Fail on registration, not on first message
+
+        idx = len(self._patterns)
+        self._patterns.append((prefixed, Rule(name, emoji, None, groups, collapse)))
+        self._compiled = None
+
+        def _register(handler: RuleHandler):
+            prefixed, rule = self._patterns[idx]
+            self._patterns[idx] = (prefixed, rule._replace(handler=handler))
+            self._compiled = None
+            return handler
+        return _register
+
+    def default(self, handler: RuleHandler):
+        """
+        Register handler for messages not matching any rule.
+        """
+        self._default = handler
+        return handler
+
+    def compile(self) -> re.Pattern:
+        self._rules = {rule.name: rule for _, rule in self._patterns}
+        self._compiled = re.compile("|".join(f"(?P<{rule.name}>{pattern})" for pattern, rule in self._patterns))
+        return self._compiled
+
+    def classify(self, message: str) -> Tuple[Rule | None, Mapping[str, str]]:
+        """
+        Find the first rule matching :param:`message`.
+
+        :return: Matching rule and its named groups, or ``None`` if no rule matches.
+        """
+        if rule := self._exact.get(message):
+            return rule, {}
+
+        compiled = self._compiled or self.compile()
+        if not self._patterns or not (match := compiled.match(message)):
+            return None, {}
+
+        # The outermost group of the matching alternative is closed last
+        rule = self._rules[match.lastgroup]
+        return rule, {group: match[full_name] for full_name, group in rule.groups}
+
+    def dispatch(self, idx: int, log: LogRecord) -> Rule | None:
+        """
+        Classify the log message, set the rule emoji and call the rule handler.
+
+        :return: Matching rule, or ``None`` if the default handler was used.
+        """
+        rule, groups = self.classify(log.message)
+        self.handle(idx, log, rule, groups)
+        return rule
+
+    def handle(self, idx: int, log: LogRecord, rule: Rule | None, groups: Mapping[str, str]):
+        """
+        Set the emoji of the already classified log message and call the rule handler.
+        """
+        if rule is None:
+            if self._default:
+                self._default(idx, log, groups)
+            return
+
+        if rule.emoji:
+            log.emoji = rule.emoji
+        if rule.handler:
+            rule.handler(idx, log, groups)
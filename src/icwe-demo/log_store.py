@@ -0,0 +1,300 @@
+"""
+Log store
+=========
+
+Append-only on-disk store of parsed device logs, for paging back through history and re-opening past sessions.
+
+Logs are appended as compact JSON lines to segment files of up to :attr:`Settings.LOG_STORE_SEGMENT_SIZE` bytes. Only
+the newest :attr:`Settings.LOG_STORE_MAX_SEGMENTS` segments are kept, so disk use is bounded too. Segments are read
+through memory maps, and only a small index is kept in memory per segment: its time range, and the devices, levels and
+sessions in it. Queries skip segments that can't match, so memory use stays flat however long the demo runs.
+
+Device clocks differ, so records are not in time order. Pages are fetched by :class:`Cursor`, the position of a
+record in the store, so records with the same timestamp are not skipped.
+
+A session is a run of the demo between starts and resets of the UI.
+"""
+
+import collections
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Counter, Iterator, List, NamedTuple, Set, Tuple
+
+from .log_record import LogRecord
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+
+
+class Cursor(NamedTuple):
+    """
+    Position of a record in the store.
+    """
+    segment: int
+    offset: int
+
+
+class Segment:
+    """
+    Index of a single segment file.
+    """
+
+    __slots__ = ("path", "number", "size", "oldest", "newest", "devices", "levels", "sessions")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.number = int(path.stem)
+        self.size = 0
+        self.oldest: float | None = None
+        self.newest: float | None = None
+        self.devices: Counter[str] = collections.Counter()
+        self.levels: Set[str] = set()
+        self.sessions: Counter[int] = collections.Counter()
+
+    def add(self, record: dict, size: int):
+        self.size += size
+        if self.oldest is None or record['t'] < self.oldest:
+            self.oldest = record['t']
+        if self.newest is None or record['t'] > self.newest:
+            self.newest = record['t']
+        self.devices[record['d']] += 1
+        self.levels.add(record['l'])
+        self.sessions[record['s']] += 1
+
+    def may_match(self, device: str | None, level: str | None, session: int | None, before: float | None,
+                  after: float | None, older: Cursor | None, newer: Cursor | None) -> bool:
+        if self.oldest is None:
+            return False
+        return ((device is None or device in self.devices)
+                and (level is None or level in self.levels)
+                and (session is None or session in self.sessions)
+                and (before is None or self.oldest < before)
+                and (after is None or self.newest > after)
+                and (older is None or self.number <= older.segment)
+                and (newer is None or self.number >= newer.segment))
+
+    def records(self, reverse: bool = False) -> Iterator[Tuple[Cursor, dict]]:
+        """
+        Read records and their positions through a memory map, last appended first if :param:`reverse`.
+        """
+        if not self.size:
+            return
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Only read up to the indexed size, the file may be appended to
+            size = min(len(data), self.size)
+            if reverse:
+                end = size
+                while end > 0:
+                    start = data.rfind(b"\n", 0, end - 1) + 1
+                    yield Cursor(self.number, start), json.loads(data[start:end])
+                    end = start
+            else:
+                start = 0
+                while start < size:
+                    end = data.find(b"\n", start) + 1 or size
+                    yield Cursor(self.number, start), json.loads(data[start:end])
+                    start = end
+
+
+class LogStore:
+    """
+    Segmented append-only log store.
+
+    :param directory: Where segment files are stored
+    :param segment_size: Size in bytes after which a new segment is started
+    :param max_segments: Number of segments kept, older ones are deleted
+    """
+
+    def __init__(self, directory: str = settings.LOG_STORE_DIR, segment_size: int = settings.LOG_STORE_SEGMENT_SIZE,
+                 max_segments: int = settings.LOG_STORE_MAX_SEGMENTS):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.max_segments = max(max_segments, 1)
+        self.segments: List[Segment] = []
+        self._file: BinaryIO | None = None
+        self._lock = threading.Lock()
+
+        #: Session of new records
+        self.session = int(time.time())
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """
+        Rebuild the index from existing segments.
+        """
+        for path in sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}")):
+            try:
+                segment = Segment(path)
+                segment.size = path.stat().st_size
+                for _, record in segment.records():
+                    segment.add(record, 0)
+            except (ValueError, KeyError, OSError) as e:
+                logger.warning("Skipping unreadable log segment %s: %s", path, e)
+                continue
+            self.segments.append(segment)
+
+        # Sessions are numbered by their start time, don't reuse a previous one
+        if sessions := self.sessions():
+            self.session = max(self.session, sessions[0][0] + 1)
+        logger.debug("Loaded %d log segments from %s", len(self.segments), self.directory)
+
+    def refresh(self):
+        """
+        Index records appended by another process, like the leader worker of :mod:`.shared_state`.
+        """
+        with self._lock:
+            if self._file is not None:
+                # Records of this process are already indexed
+                return
+            known = {segment.path: segment for segment in self.segments}
+            segments = []
+            for path in sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}")):
+                try:
+                    segment = known.get(path) or Segment(path)
+                    with open(path, "rb") as file:
+                        file.seek(segment.size)
+                        data = file.read()
+                    # Skip a line that is still being written
+                    for line in data[:data.rfind(b"\n") + 1].splitlines(keepends=True):
+                        segment.add(json.loads(line), len(line))
+                except (ValueError, KeyError, OSError) as e:
+                    logger.warning("Skipping unreadable log segment %s: %s", path, e)
+                    continue
+                segments.append(segment)
+            self.segments = segments
+
+    def new_session(self) -> int:
+        """
+        Start a new session for the following records.
+        """
+        with self._lock:
+            self.session = max(int(time.time()), self.session + 1)
+            return self.session
+
+    def append(self, log: LogRecord):
+        """
+        Append parsed log entry.
+        """
+        record = {
+            "t": log.time / 1000,
+            "s": self.session,
+            "d": log.device,
+            "l": (log.level or "INFO").upper(),
+            "m": log.message,
+        }
+        if log.module:
+            record["mod"] = log.module
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+        with self._lock:
+            if self._file is None or self.segments[-1].size + len(line) > self.segment_size:
+                self._roll()
+            self._file.write(line)
+            self.segments[-1].add(record, len(line))
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _roll(self):
+        """
+        Start a new segment, and delete segments over :attr:`max_segments`.
+        """
+        if self._file is not None:
+            self._file.close()
+
+        number = self.segments[-1].number + 1 if self.segments else 0
+        segment = Segment(self.directory / f"{number:08d}{SEGMENT_SUFFIX}")
+        self._file = open(segment.path, "ab")
+        self.segments.append(segment)
+
+        while len(self.segments) > self.max_segments:
+            oldest = self.segments.pop(0)
+            try:
+                os.unlink(oldest.path)
+            except FileNotFoundError:
+                pass
+
+    def sessions(self) -> List[Tuple[int, int]]:
+        """
+        Sessions and their number of records, newest first.
+        """
+        counts: Counter[int] = collections.Counter()
+        for segment in list(self.segments):
+            counts.update(segment.sessions)
+        return sorted(counts.items(), reverse=True)
+
+    def query(self, device: str | None = None, level: str | None = None, module: str | None = None,
+              session: int | None = None, before: float | None = None, after: float | None = None,
+              older: Cursor | None = None, newer: Cursor | None = None, limit: int = 50) -> List[Tuple[Cursor, dict]]:
+        """
+        Find records matching the filters.
+
+        Returns the last :param:`limit` appended records, or those appended before :param:`older`. If :param:`newer`
+        is given, returns the first records appended after it instead. Records are in the order they were appended.
+
+        :param module: Substring of the module name
+        :param before: Only records logged before this time, in seconds since epoch
+        :param after: Only records logged after this time, in seconds since epoch
+        :return: Positions and records
+        """
+        self.flush()
+        self.refresh()
+        reverse = newer is None
+        segments = [segment for segment in list(self.segments)
+                    if segment.may_match(device, level, session, before, after, older, newer)]
+        if reverse:
+            segments.reverse()
+
+        found = []
+        for segment in segments:
+            for cursor, record in segment.records(reverse=reverse):
+                if ((older is not None and cursor >= older)
+                        or (newer is not None and cursor <= newer)
+                        or (before is not None and record['t'] >= before)
+                        or (after is not None and record['t'] <= after)
+                        or (device is not None and record['d'] != device)
+                        or (level is not None and record['l'] != level)
+                        or (session is not None and record['s'] != session)
+                        or (module and module not in record.get('mod', ""))):
+                    continue
+                found.append((cursor, record))
+                if len(found) >= limit:
+                    break
+            if len(found) >= limit:
+                break
+
+        return found[::-1] if reverse else found
+
+
+_store: LogStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_log_store() -> LogStore | None:
+    """
+    Get the shared :class:`LogStore`, or ``None`` if :attr:`Settings.LOG_STORE_DIR` is empty.
+    """
+    global _store
+    if not settings.LOG_STORE_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = LogStore()
+    return _store
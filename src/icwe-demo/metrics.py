@@ -0,0 +1,234 @@
+"""
+Metrics
+=======
+
+Counters, gauges and histograms of the hot paths, rendered in the Prometheus text format for the ``/metrics`` route.
+
+Metrics are created at module level next to the code they measure, and are registered in :data:`REGISTRY` on
+creation. Gauges of values that already exist elsewhere, like queue lengths, take a ``function`` that is called when
+the metrics are rendered, so the hot path doesn't pay for them.
+"""
+
+import contextlib
+import functools
+import inspect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+#: Default histogram buckets in seconds
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+
+class Registry:
+    """
+    Collection of metrics to render.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, "Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name!r} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    Base class for metrics.
+
+    :param name: Metric name, like ``icwe_logs_parsed_total``
+    :param help: Description of the metric
+    :param labels: Label names, values are given in the order of the names
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry | None = REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"Expected labels {self.label_names} for {self.name}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format(self, name: str, key: LabelValues, value: float, extra: Dict[str, str] | None = None) -> str:
+        labels = dict(zip(self.label_names, key))
+        if extra:
+            labels.update(extra)
+        if labels:
+            label_text = ",".join(f'{label}="{_escape(val)}"' for label, val in labels.items())
+            name = f"{name}{{{label_text}}}"
+        return f"{name} {_format_value(value)}"
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class _Value(Metric):
+    """
+    Single value per label values.
+
+    :param function: Called on render, returns the value, or values by label values for labeled metrics
+    """
+
+    def __init__(self, *args, function: Callable[[], float | Dict[LabelValues, float]] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.function = function
+        self._values: Dict[LabelValues, float] = {}
+
+    def samples(self) -> Iterator[str]:
+        if self.function is not None:
+            values = self.function()
+            items = values.items() if isinstance(values, dict) else [((), values)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in items:
+            if value is not None:
+                yield self._format(self.name, key, value)
+
+
+class Counter(_Value):
+    """
+    Monotonically increasing count.
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Value):
+    """
+    Value that can go up and down.
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+
+    :param buckets: Upper bounds of the buckets, in increasing order
+    """
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # Bucket counts, sum and count by label values
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            if (entry := self._values.get(key)) is None:
+                entry = self._values[key] = ([0] * len(self.buckets), [0., 0])
+            counts, totals = entry
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            totals[0] += value
+            totals[1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: str):
+        """
+        Observe the duration of the block in seconds.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [(key, list(counts), list(totals)) for key, (counts, totals) in self._values.items()]
+        for key, counts, (total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self._format(f"{self.name}_bucket", key, cumulative, {"le": _format_value(bound)})
+            yield self._format(f"{self.name}_bucket", key, count, {"le": "+Inf"})
+            yield self._format(f"{self.name}_sum", key, total)
+            yield self._format(f"{self.name}_count", key, count)
+
+
+def timed(histogram: Histogram, **labels: str):
+    """
+    Decorator observing the duration of calls in :param:`histogram`.
+
+    Works with functions, coroutine functions and async generator functions, like Gradio event handlers. Async
+    generators are timed until they are exhausted.
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    async for item in func(*args, **kwargs):
+                        yield item
+        elif inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
@@ -0,0 +1,223 @@
+"""
+Record and replay
+=================
+
+Recordings of what the demo receives from the orchestrator, to reproduce incidents and load-test the UI without an
+orchestrator or devices.
+
+With :attr:`Settings.RECORD_PATH` set, the demo appends to that file everything :func:`.utils.pull_logs` receives,
+the responses of :func:`.utils.ado_deployment` and :func:`.utils.arun_deployment`, the orchestrator state whenever
+it changes, and the results of health probes. A recording is JSON lines of::
+
+    {"t": <seconds since start of recording>, "kind": "state" | "log" | "deploy" | "run" | "health", "key": ...,
+     "data": ...}
+
+Every run of the demo starts a new session in the file with a ``session`` entry, and times restart from it. Sessions
+are replayed one after the other.
+
+With :attr:`Settings.REPLAY_PATH` set, the demo starts from the first recorded state, and :class:`Replay` feeds the
+recorded logs into :data:`.SETUP.logs_queue` at :attr:`Settings.REPLAY_SPEED` times their recorded pace, instead of
+pulling logs. Deployments and runs are answered with the recorded responses of the same deployment, and health with
+the recorded health, see :meth:`.health.HealthMonitor.follow`. Devices are not probed. Timestamps of replayed logs are
+shifted to the time of replay, so latency tracing and coalescing work as they would live.
+
+At speed ``0`` logs are replayed as fast as the parser takes them, without dropping any. At other speeds the queue
+behaves as with live logs, so logs are dropped if the parser can't keep up.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Tuple
+
+from . import shared_state
+from ._typing import DeploymentID
+from .log_record import LogRecord
+from .settings import settings
+from .snapshot import apply_state
+from .SETUP import DEVICE_INDEX, logs_queue
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("state", "log", "deploy", "run", "health")
+
+
+class Recorder:
+    """
+    Append recorded entries to :param:`path`.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        logger.info("Recording orchestrator traffic to %s", self.path)
+        self.record("session", {"started": time.time()})
+
+    def record(self, kind: str, data: Any, key: str | None = None):
+        entry = {"t": round(time.monotonic() - self._started, 6), "kind": kind, "data": data}
+        if key is not None:
+            entry["key"] = key
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            # Keep the recording of a crashed demo
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Replay:
+    """
+    Replay of a recording.
+
+    :param path: Recording file
+    :param speed: Times the recorded pace, ``0`` replays as fast as possible
+    """
+
+    def __init__(self, path: str, speed: float = 1.):
+        self.path = Path(path)
+        self.speed = speed
+        self.entries: List[dict] = []
+        # Recorded responses by kind and deployment
+        self._responses: Dict[Tuple[str, DeploymentID], Deque[Any]] = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        #: Number of logs replayed
+        self.replayed = 0
+        #: Set when all logs have been replayed
+        self.done = threading.Event()
+
+        self._load()
+
+    def _load(self):
+        # Times of each session start from zero, continue from the end of the previous session
+        offset = end = 0.
+        with open(self.path, encoding="utf-8") as file:
+            for lineno, line in enumerate(file, start=1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping invalid line %d of recording %s", lineno, self.path)
+                    continue
+                if entry.get("kind") == "session":
+                    offset = end
+                    continue
+                if entry.get("kind") not in KINDS:
+                    continue
+                entry["t"] = end = offset + entry.get("t", 0.)
+                if entry["kind"] in ("deploy", "run"):
+                    self._responses[entry["kind"], entry.get("key")].append(entry["data"])
+                else:
+                    self.entries.append(entry)
+        logger.info("Loaded recording %s: %d logs", self.path, sum(e["kind"] == "log" for e in self.entries))
+
+    def initial_state(self) -> dict | None:
+        """
+        First recorded orchestrator state.
+        """
+        return next((entry["data"] for entry in self.entries if entry["kind"] == "state"), None)
+
+    def response(self, kind: str, deployment_id: DeploymentID) -> Any:
+        """
+        Next recorded response to :param:`kind` of deployment :param:`deployment_id`. The last one is repeated.
+
+        :raises LookupError: If none was recorded
+        """
+        with self._lock:
+            responses = self._responses.get((kind, deployment_id))
+            if not responses:
+                raise LookupError(f"No recorded {kind} response for deployment {deployment_id}")
+            return responses.popleft() if len(responses) > 1 else responses[0]
+
+    def run(self):
+        """
+        Feed recorded logs into :data:`.SETUP.logs_queue`, and apply later recorded states and health.
+        """
+        # Imported here, as health records with the recorder
+        from .health import get_monitor
+
+        if self.speed:
+            logger.info("Replaying %s at %g× speed", self.path, self.speed)
+        else:
+            logger.info("Replaying %s at maximum speed", self.path)
+
+        started = time.monotonic()
+        first_state = True
+        for entry in self.entries:
+            if self._stop.is_set():
+                break
+
+            if self.speed:
+                delay = started + entry["t"] / self.speed - time.monotonic()
+                if delay > 0 and self._stop.wait(delay):
+                    break
+
+            if entry["kind"] == "state":
+                # First state is applied on startup, see :meth:`initial_state`
+                if not first_state:
+                    apply_state(entry["data"], self.path)
+                first_state = False
+                continue
+
+            if entry["kind"] == "health":
+                if (shared := shared_state.get_shared_state()) is not None:
+                    shared.publish("health", status=entry["data"])
+                else:
+                    get_monitor().follow(entry["data"])
+                continue
+
+            if (log := LogRecord.from_json(entry["data"], DEVICE_INDEX)) is None:
+                continue
+            # Shift timestamps as if the log was received now
+            delta = log.ingested - (log.received or log.time)
+            log.time += delta
+            if log.received is not None:
+                log.received += delta
+
+            logs_queue.put(log, timeout=None if not self.speed else settings.LOG_QUEUE_PUT_TIMEOUT)
+            self.replayed += 1
+
+        logger.info("Replayed %d logs in %.1f s", self.replayed, time.monotonic() - started)
+        self.done.set()
+
+    def stop(self):
+        self._stop.set()
+
+
+_recorder: Recorder | None = None
+_replay: Replay | None = None
+_lock = threading.Lock()
+
+
+def get_recorder() -> Recorder | None:
+    """
+    Get the shared :class:`Recorder`, or ``None`` if :attr:`Settings.RECORD_PATH` is empty.
+    """
+    global _recorder
+    if not settings.RECORD_PATH:
+        return None
+    with _lock:
+        if _recorder is None:
+            _recorder = Recorder(settings.RECORD_PATH)
+    return _recorder
+
+
+def get_replay() -> Replay | None:
+    """
+    Get the shared :class:`Replay`, or ``None`` if :attr:`Settings.REPLAY_PATH` is empty.
+    """
+    global _replay
+    if not settings.REPLAY_PATH:
+        return None
+    with _lock:
+        if _replay is None:
+            _replay = Replay(settings.REPLAY_PATH, settings.REPLAY_SPEED)
+    return _replay
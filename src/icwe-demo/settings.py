@@ -5,6 +5,7 @@ Important environment variables:
 """
 
 import os
+from typing import Literal
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -12,14 +13,181 @@ os.environ.setdefault('WASMIOT_ORCHESTRATOR_URL', 'http://localhost:3000')
 os.environ.setdefault('WASMIOT_LOGGING_ENDPOINT', f"{os.environ['WASMIOT_ORCHESTRATOR_URL']}/device/logs")
 
 class Settings(BaseSettings):
+    LOG_LEVEL: str = Field("DEBUG",
+                           env="LOG_LEVEL",
+                           description="Level of the demo's own logging. Use INFO or higher under load")
+
+    STARTUP_PROFILE: bool = Field(False,
+                                  env="STARTUP_PROFILE",
+                                  description="Log the duration of each startup stage when the demo is ready")
+
     LOG_PULL_DELAY: float = Field(.5,
                                   env="LOG_PULL_DELAY",
                                   description="Delay between log pulls from orchestrator")
 
+    LOG_PULL_ACTIVE_DELAY: float = Field(.1,
+                                         env="LOG_PULL_ACTIVE_DELAY",
+                                         description="Delay between log pulls while a deployment is running")
+
+    LOG_PULL_MAX_DELAY: float = Field(5.,
+                                      env="LOG_PULL_MAX_DELAY",
+                                      description="Upper bound for the idle log pull backoff")
+
+    LOG_ACTIVE_LINGER: float = Field(10.,
+                                     env="LOG_ACTIVE_LINGER",
+                                     description="Seconds to keep polling tightly after a deployment action ends")
+
+    LOG_QUEUE_CAPACITY: int = Field(256,
+                                    env="LOG_QUEUE_CAPACITY",
+                                    description="Maximum number of logs waiting to be parsed")
+
+    LOG_QUEUE_LOW_WATERMARK: float = Field(.5,
+                                           env="LOG_QUEUE_LOW_WATERMARK",
+                                           description="Fraction of the log queue to drain before pulling more logs")
+
+    LOG_QUEUE_PUT_TIMEOUT: float = Field(1.,
+                                         env="LOG_QUEUE_PUT_TIMEOUT",
+                                         description="Seconds to wait for the parser before dropping old logs")
+
+    LOG_PARSE_BATCH: int = Field(64,
+                                 env="LOG_PARSE_BATCH",
+                                 description="Number of logs parsed between UI updates")
+
+    LOG_COALESCE_WINDOW: float = Field(5.,
+                                       env="LOG_COALESCE_WINDOW",
+                                       description="Seconds in which repeated log messages are shown as one line, "
+                                                   "0 to disable")
+
+    TRACE_HISTORY: int = Field(50,
+                               env="TRACE_HISTORY",
+                               description="Number of recent log traces shown in the latency panel")
+
+    TRACE_PANEL_INTERVAL: float = Field(2.,
+                                        env="TRACE_PANEL_INTERVAL",
+                                        description="Seconds between updates of the latency panel")
+
+    LOG_HISTORY_LENGTH: int = Field(100,
+                                    env="LOG_HISTORY_LENGTH",
+                                    description="Number of log lines shown per device")
+
+    LOG_INGEST_MODE: Literal["poll", "longpoll", "stream"] = Field("poll",
+                                                                   env="LOG_INGEST_MODE",
+                                                                   description="How logs are pulled from orchestrator")
+
+    LOG_LONGPOLL_TIMEOUT: float = Field(25.,
+                                        env="LOG_LONGPOLL_TIMEOUT",
+                                        description="Seconds the server may hold a long-poll or stream request")
+
+    LOG_UI_MODE: Literal["push", "poll"] = Field("push",
+                                                 env="LOG_UI_MODE",
+                                                 description="Push log updates to browsers, or let browsers poll them")
+
+    LOG_STREAM_KEEPALIVE: float = Field(15.,
+                                        env="LOG_STREAM_KEEPALIVE",
+                                        description="Seconds between log stream keepalives when nothing changes")
+
+    CHAT_HISTORY_LENGTH: int = Field(50,
+                                     env="CHAT_HISTORY_LENGTH",
+                                     description="Number of chat messages shown to a viewer")
+
+    CHAT_PACING: Literal["wobbly", "fixed", "off"] = Field("wobbly",
+                                                         env="CHAT_PACING",
+                                                         description="Pacing of consecutive chat messages, "
+                                                                     "by STEP_DELAY")
+
+    UI_COLUMNS: int = Field(4,
+                            env="UI_COLUMNS",
+                            description="Number of device columns per row in the UI")
+
     STEP_DELAY: float = Field(1.5,
                               env="STEP_DELAY",
                               description="Delay between steps in the demo")
 
+    ORCHESTRATOR_MAX_CONNECTIONS: int = Field(20,
+                                              env="ORCHESTRATOR_MAX_CONNECTIONS",
+                                              description="Size of the HTTP connection pool")
+
+    ORCHESTRATOR_RETRIES: int = Field(2,
+                                      env="ORCHESTRATOR_RETRIES",
+                                      description="Maximum retries for a failed orchestrator request")
+
+    SNAPSHOT_PATH: str = Field(".icwe-demo-snapshot.json",
+                               env="SNAPSHOT_PATH",
+                               description="Warm-start snapshot of orchestrator state. Set empty to disable")
+
+    HEALTH_CHECK_INTERVAL: float = Field(15.,
+                                         env="HEALTH_CHECK_INTERVAL",
+                                         description="Seconds between background health checks")
+
+    HEALTH_WINDOW: int = Field(20,
+                               env="HEALTH_WINDOW",
+                               description="Number of health checks used for rolling latency and availability")
+
+    DEPLOY_CACHE: bool = Field(True,
+                               env="DEPLOY_CACHE",
+                               description="Skip deploying solutions that are already deployed on their devices")
+
+    INVENTORY_REFRESH_INTERVAL: float = Field(30.,
+                                              env="INVENTORY_REFRESH_INTERVAL",
+                                              description="Seconds between module and deployment refreshes")
+
+    IMAGE_CACHE_DIR: str = Field(".icwe-demo-images",
+                                 env="IMAGE_CACHE_DIR",
+                                 description="Directory of cached result images")
+
+    IMAGE_CACHE_SIZE: int = Field(64 * 1024 * 1024,
+                                  env="IMAGE_CACHE_SIZE",
+                                  description="Maximum size of cached result images in bytes")
+
+    IMAGE_THUMBNAIL_SIZE: int = Field(320,
+                                      env="IMAGE_THUMBNAIL_SIZE",
+                                      description="Maximum width and height of result thumbnails in the chat")
+
+    LOG_STORE_DIR: str = Field(".icwe-demo-logs",
+                               env="LOG_STORE_DIR",
+                               description="Directory of the on-disk log store. Set empty to disable")
+
+    LOG_STORE_SEGMENT_SIZE: int = Field(4 * 1024 * 1024,
+                                        env="LOG_STORE_SEGMENT_SIZE",
+                                        description="Size of log store segment files in bytes")
+
+    LOG_STORE_MAX_SEGMENTS: int = Field(64,
+                                        env="LOG_STORE_MAX_SEGMENTS",
+                                        description="Number of log store segments kept, older ones are deleted")
+
+    RECORD_PATH: str = Field("",
+                             env="RECORD_PATH",
+                             description="Record received logs and orchestrator responses to this file")
+
+    REPLAY_PATH: str = Field("",
+                             env="REPLAY_PATH",
+                             description="Replay logs and orchestrator responses from this recording, "
+                                         "instead of using the orchestrator")
+
+    REPLAY_SPEED: float = Field(1.,
+                                env="REPLAY_SPEED",
+                                description="Replay speed relative to the recording, 0 for as fast as possible")
+
+    WORKERS: int = Field(1,
+                         env="WORKERS",
+                         description="Number of server processes, serving consecutive ports from PORT")
+
+    PORT: int = Field(7860,
+                      env="PORT",
+                      description="HTTP port of the first server process")
+
+    STATE_DIR: str = Field(".icwe-demo-state",
+                           env="STATE_DIR",
+                           description="Directory of the state shared by server processes")
+
+    STATE_POLL_INTERVAL: float = Field(.05,
+                                       env="STATE_POLL_INTERVAL",
+                                       description="Seconds between reads of the shared state by server processes")
+
+    STATE_JOURNAL_SIZE: int = Field(8 * 1024 * 1024,
+                                    env="STATE_JOURNAL_SIZE",
+                                    description="Size in bytes after which the shared state journal is compacted")
+
     WASMIOT_ORCHESTRATOR_URL: str = "http://localhost:3000"
     WASMIOT_LOGGING_ENDPOINT: str = f"{WASMIOT_ORCHESTRATOR_URL}/device/logs"
 
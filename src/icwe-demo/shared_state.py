@@ -0,0 +1,265 @@
+"""
+Shared state
+============
+
+State shared by the worker processes of the demo, see :attr:`Settings.WORKERS`.
+
+Each worker keeps its own copy of the module-level state, like :data:`.SETUP.DEPLOYMENTS`, :data:`.ui.chat_history`
+and :data:`.ui.log_history`, so Gradio callbacks keep reading local memory. Changes are not applied directly, but
+published to a journal in :attr:`Settings.STATE_DIR`, an append-only file of JSON lines. Every worker, including the
+one that published the change, tails the journal and applies the entries in journal order with the handlers
+registered with :func:`on`, so all workers see the same state.
+
+One worker is elected leader with a file lock. The leader pulls and parses logs and monitors health, and publishes
+the results for all workers. If the leader exits, the lock is released and another worker takes over.
+
+When the journal grows over :attr:`Settings.STATE_JOURNAL_SIZE`, the leader replaces it with a compacted journal of
+the current state, from the functions registered with :func:`snapshot`. Compacted journals start with a ``reset``
+entry, so followers reading them rebuild their view from the entries that follow. The leader already has that state
+and continues after them.
+
+Example::
+
+    @shared_state.on("chat")
+    def _on_chat(entry):
+        chat_history.publish(entry['event'])
+
+    if (shared := shared_state.get_shared_state()) is not None:
+        shared.publish("chat", event=event)
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, IO, Iterable, List, Tuple
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Handlers of journal entries by kind, called with the entry
+Handler = Callable[[dict], None]
+HANDLERS: Dict[str, List[Handler]] = {}
+
+# Functions returning the entries that recreate part of the current state
+Snapshot = Callable[[], Iterable[Tuple[str, dict]]]
+SNAPSHOTS: List[Snapshot] = []
+
+
+def on(kind: str):
+    """
+    Decorator registering handler of journal entries of :param:`kind`.
+    """
+    def _register(handler: Handler):
+        HANDLERS.setdefault(kind, []).append(handler)
+        return handler
+    return _register
+
+
+def snapshot(func: Snapshot):
+    """
+    Decorator registering function returning ``(kind, data)`` entries of the current state, for compaction.
+    """
+    SNAPSHOTS.append(func)
+    return func
+
+
+class SharedState:
+    """
+    Journal of state changes and leader election of the workers.
+
+    :param directory: Directory of the journal and lock files
+    :param poll_interval: Seconds between reads of the journal
+    :param max_size: Journal size in bytes after which the leader compacts it
+    """
+
+    def __init__(self, directory: str = settings.STATE_DIR, poll_interval: float = settings.STATE_POLL_INTERVAL,
+                 max_size: int = settings.STATE_JOURNAL_SIZE):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / "journal.jsonl"
+        self.poll_interval = poll_interval
+        self.max_size = max_size
+
+        #: Whether this worker is the leader
+        self.leader = False
+
+        self._journal: IO[bytes] | None = None
+        self._buffer = b""
+        self._leader_lock: IO | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Appends to the journal one at a time, in publishing order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state-writer")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the journal lock, for publishing and compacting.
+        """
+        with open(self.directory / "journal.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def publish(self, kind: str, **data):
+        """
+        Append entry of :param:`kind` to the journal. It is applied when the workers next read the journal.
+
+        Waiting for the journal lock would block an event loop, so when called from one the entry is appended in the
+        background. Other callers wait until it has been appended, after any entries published before it.
+        """
+        line = json.dumps({"kind": kind, **data}, ensure_ascii=False, default=str).encode() + b"\n"
+        future = self._writer.submit(self._append, line)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            future.result()
+        else:
+            future.add_done_callback(_log_append_error)
+
+    def _append(self, line: bytes):
+        with self._locked(), open(self.path, "ab") as journal:
+            journal.write(line)
+
+    def elect(self) -> bool:
+        """
+        Try to become the leader.
+        """
+        if self.leader:
+            return True
+        lock = open(self.directory / "leader.lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._leader_lock = lock
+        self.leader = True
+        logger.info("Worker %d elected leader", os.getpid())
+        return True
+
+    def compact(self):
+        """
+        Replace the journal with the current state of this worker.
+        """
+        with self._locked():
+            # Include entries published before the lock
+            self.poll()
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "wb") as journal:
+                journal.write(json.dumps({"kind": "reset"}).encode() + b"\n")
+                for func in SNAPSHOTS:
+                    for kind, data in func():
+                        journal.write(json.dumps({"kind": kind, **data}, ensure_ascii=False, default=str).encode()
+                                      + b"\n")
+            os.replace(tmp_path, self.path)
+
+            # This worker has the compacted state, continue after it
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = open(self.path, "rb")
+            self._journal.seek(0, os.SEEK_END)
+            self._buffer = b""
+        logger.debug("Compacted shared state journal %s", self.path)
+
+    def poll(self) -> int:
+        """
+        Apply new journal entries.
+
+        :return: Number of entries applied
+        """
+        count = 0
+        while True:
+            if self._journal is None:
+                try:
+                    self._journal = open(self.path, "rb")
+                except FileNotFoundError:
+                    return count
+                self._buffer = b""
+
+            data = self._journal.read()
+            if data:
+                *lines, self._buffer = (self._buffer + data).split(b"\n")
+                for line in lines:
+                    self._apply(line)
+                count += len(lines)
+
+            # Compacted journal replaces the file, continue from its start
+            try:
+                replaced = os.stat(self.path).st_ino != os.fstat(self._journal.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+            if not replaced:
+                return count
+            self._journal.close()
+            self._journal = None
+
+    def _apply(self, line: bytes):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            logger.warning("Skipping invalid shared state entry: %r", line[:100])
+            return
+        for handler in HANDLERS.get(entry.get("kind"), ()):
+            try:
+                handler(entry)
+            except Exception as e:
+                logger.error("Error applying shared %s: %s", entry.get("kind"), e, exc_info=True)
+
+    def start(self, on_elected: Callable[[], None]):
+        """
+        Read the journal in the background, and try to become the leader when there is none.
+
+        If this worker is elected, the journal is compacted and :param:`on_elected` is called.
+        """
+        def _run():
+            while not self._stop.is_set():
+                try:
+                    self.poll()
+                    if not self.leader and self.elect():
+                        self.compact()
+                        threading.Thread(target=on_elected, name="leader", daemon=True).start()
+                    elif self.leader and self.path.exists() and self.path.stat().st_size > self.max_size:
+                        self.compact()
+                except Exception as e:
+                    logger.error("Error reading shared state: %s", e, exc_info=True)
+                self._stop.wait(self.poll_interval)
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=_run, name="shared-state", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._writer.shutdown(wait=True)
+
+
+def _log_append_error(future: Future):
+    if (e := future.exception()) is not None:
+        logger.error("Error publishing shared state: %s", e, exc_info=e)
+
+
+_shared: SharedState | None = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState | None:
+    """
+    Get the :class:`SharedState` of this worker, or ``None`` if there is a single worker.
+    """
+    global _shared
+    if settings.WORKERS <= 1:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedState()
+    return _shared
@@ -0,0 +1,96 @@
+"""
+Warm-start snapshot
+===================
+
+Last good orchestrator state (devices, modules and deployments) saved on disk, so that the demo can start without
+waiting for the orchestrator. See :func:`.utils.pull_orchestrator_state`.
+"""
+
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+
+from .SETUP import DEVICES, DISCOVER_DEVICES, MODULES, DEPLOYMENTS, index_devices, set_deployments, set_modules
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_state() -> dict:
+    """
+    Current devices, modules and deployments, as saved in a snapshot.
+    """
+    return {
+        "saved": datetime.datetime.now(datetime.UTC).isoformat(),
+        "devices": DEVICES,
+        "modules": MODULES,
+        "deployments": DEPLOYMENTS,
+    }
+
+
+def save_snapshot(path: str | os.PathLike):
+    """
+    Write current :data:`SETUP.DEVICES`, :data:`SETUP.MODULES` and :data:`SETUP.DEPLOYMENTS` to :param:`path`.
+
+    The file is replaced atomically, so a crash while writing leaves the previous snapshot in place.
+    """
+    path = Path(path)
+    state = snapshot_state()
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not save snapshot to %s: %s", path, e)
+        return
+
+    logger.debug("Saved snapshot to %s", path)
+
+
+def load_snapshot(path: str | os.PathLike) -> bool:
+    """
+    Populate state from snapshot at :param:`path`.
+
+    Devices defined in :mod:`.SETUP` keep their configured values; the snapshot only fills in missing ones.
+
+    :return: ``True`` if snapshot was loaded
+    """
+    path = Path(path)
+    try:
+        state = json.loads(path.read_text())
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        return False
+
+    return apply_state(state, path)
+
+
+def apply_state(state: dict, source: str | os.PathLike) -> bool:
+    """
+    Populate state from :param:`state` of :func:`snapshot_state`, loaded from :param:`source`.
+
+    :return: ``True`` if state was applied
+    """
+    if not state.get("modules") or not state.get("deployments"):
+        logger.warning("Ignoring incomplete snapshot %s", source)
+        return False
+
+    snapshot_devices = {dev['name']: dev for dev in state.get("devices", []) if dev.get('name')}
+    if DISCOVER_DEVICES:
+        # Devices are discovered from orchestrator, use the ones seen last time
+        DEVICES.extend(dev for name, dev in snapshot_devices.items() if name not in {d['name'] for d in DEVICES})
+    for dev in DEVICES:
+        for key, value in snapshot_devices.get(dev['name'], {}).items():
+            dev.setdefault(key, value)
+    index_devices()
+
+    set_modules(state["modules"])
+    set_deployments(state["deployments"])
+
+    logger.info("Loaded %d modules and %d deployments from snapshot %s (saved %s)",
+                len(MODULES), len(DEPLOYMENTS), source, state.get("saved"))
+    return True
@@ -0,0 +1,135 @@
+"""
+Startup
+=======
+
+Fast startup on slow kiosk hosts: the HTTP port is bound first, with a "starting" page, while the heavy parts of the
+demo, like importing gradio and building the UI, run in the background.
+
+:class:`DeferredApp` is a plain ASGI app, so serving the starting page doesn't import FastAPI or gradio. It answers
+requests with :data:`STARTING_PAGE` until its ``build`` function has returned the real app, then runs the lifespan of
+the real app on the server's event loop and forwards everything to it.
+
+:data:`profile` records the duration of each startup stage in the ``icwe_startup_seconds`` gauge. With
+:attr:`Settings.STARTUP_PROFILE` set, the stages are also logged once the demo is ready.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import time
+from typing import Any, Callable, Dict
+
+from . import metrics
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+STARTING_PAGE = b"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta http-equiv="refresh" content="2">
+<title>WasmIoT ICWE Demo</title>
+<style>
+body { font-family: sans-serif; display: flex; height: 90vh; align-items: center; justify-content: center; }
+</style>
+</head>
+<body><h1>Starting the WasmIoT demo&hellip;</h1></body>
+</html>
+"""
+
+
+class StartupProfile:
+    """
+    Durations of startup stages, in order.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._gauge = metrics.Gauge("icwe_startup_seconds", "Duration of startup stages", ["stage"],
+                                    function=lambda: {(stage,): seconds for stage, seconds in self.stages.items()})
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - started
+
+    def mark(self, name: str):
+        """
+        Record :param:`name` as reached now, timed from the start of the process.
+        """
+        self.stages[name] = time.perf_counter() - self.started
+
+    def report(self) -> str:
+        width = max(map(len, self.stages), default=0)
+        return "\n".join(f"{stage:<{width}} {seconds * 1000:8.1f} ms" for stage, seconds in self.stages.items())
+
+
+profile = StartupProfile()
+
+
+class DeferredApp:
+    """
+    ASGI app serving a starting page until the real app has been built.
+
+    :param build: Returns the real app, a FastAPI or Starlette app. Called in a background thread.
+    """
+
+    def __init__(self, build: Callable[[], Any]):
+        self.build = build
+        self.app = None
+        self._stopping: asyncio.Event | None = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif self.app is not None:
+            await self.app(scope, receive, send)
+        elif scope["type"] == "http":
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"text/html; charset=utf-8"), (b"retry-after", b"2")],
+            })
+            await send({"type": "http.response.body", "body": STARTING_PAGE})
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1013})
+
+    async def _lifespan(self, receive, send):
+        """
+        Let the server bind the port right away, and build the real app in the background.
+        """
+        self._stopping = asyncio.Event()
+        await receive()
+        profile.mark("server")
+        await send({"type": "lifespan.startup.complete"})
+
+        task = asyncio.create_task(self._start())
+        await receive()
+        self._stopping.set()
+        with contextlib.suppress(Exception):
+            await task
+        await send({"type": "lifespan.shutdown.complete"})
+
+    async def _start(self):
+        try:
+            app = await asyncio.to_thread(self.build)
+            started = time.perf_counter()
+            async with app.router.lifespan_context(app):
+                profile.stages["lifespan"] = time.perf_counter() - started
+                self.app = app
+                profile.mark("ready")
+                logger.info("Demo is ready")
+                if settings.STARTUP_PROFILE:
+                    logger.info("Startup profile:\n%s", profile.report())
+                await self._stopping.wait()
+        except Exception as e:
+            # Exit like a failed start in the foreground would, instead of showing the starting page forever
+            logger.critical("Could not start the demo: %s", e, exc_info=True)
+            os.kill(os.getpid(), signal.SIGTERM)
@@ -0,0 +1,234 @@
+"""
+Latency tracing
+===============
+
+Traces of device logs from the device to the browser, to tell apart slow devices, a slow orchestrator and a slow UI.
+
+A :class:`Trace` records when a log passed each stage of :data:`STAGES`:
+
+- ``device``: ``timestamp`` of the log, set by the device
+- ``orchestrator``: ``dateReceived`` of the log, set by the orchestrator
+- ``ingest``: received by :mod:`.log_ingest` and converted to a :class:`.log_record.LogRecord`
+- ``parse``: parsed by :func:`.ui.log_parser`
+- ``publish``: chat event published to :data:`.ui.chat_history`, or to the journal of :mod:`.shared_state`, if the
+  log caused one. Otherwise its log line published to :data:`.ui.log_history` or the journal
+- ``pacing``: chat event taken by the first browser stream, after its :attr:`Settings.CHAT_PACING` delay. Log lines
+  are not paced
+- ``ui``: chat event pushed to the first browser, or the log textbox with its line if the log caused no chat event
+
+The time from the previous stage is observed in the ``icwe_trace_stage_seconds`` histogram of :mod:`.metrics`, labeled
+with the later stage. Device and orchestrator times come from their clocks, so their delays include any clock skew.
+Pushing to the browser is measured when the update has been sent, rendering in the browser is not included.
+"""
+
+import collections
+import contextlib
+import itertools
+import os
+import statistics
+import threading
+import time
+from typing import Deque, Dict, List, Tuple
+
+from . import metrics
+from .log_record import LogRecord
+from .settings import settings
+
+STAGES = ("device", "orchestrator", "ingest", "parse", "publish", "pacing", "ui")
+
+STAGE_SECONDS = metrics.Histogram("icwe_trace_stage_seconds", "Latency of a log from the previous stage", ["stage"])
+
+
+class Trace:
+    """
+    Times a single log passed each stage, as seconds since epoch.
+    """
+
+    __slots__ = ("device", "message", "times")
+
+    def __init__(self, device: str, message: str):
+        self.device = device
+        self.message = message
+        self.times: Dict[str, float] = {}
+
+    def mark(self, stage: str, at: float | None = None):
+        """
+        Record :param:`stage` at :param:`at`, defaults to now, and observe the delay from the previous stage.
+        """
+        if at is None:
+            at = time.time()
+        self.times[stage] = at
+        if (delay := self.delay(stage)) is not None:
+            STAGE_SECONDS.observe(max(delay, 0.), stage=stage)
+
+    def delay(self, stage: str) -> float | None:
+        """
+        Seconds from the latest recorded stage before :param:`stage`.
+        """
+        if (at := self.times.get(stage)) is None:
+            return None
+        for previous in reversed(STAGES[:STAGES.index(stage)]):
+            if (previous_at := self.times.get(previous)) is not None:
+                return at - previous_at
+        return None
+
+    def delays(self) -> Dict[str, float | None]:
+        return {stage: self.delay(stage) for stage in STAGES[1:]}
+
+
+class Tracer:
+    """
+    Recent traces, and traces waiting for their chat event or log line to reach a browser.
+
+    :param history: Number of recent traces kept
+    """
+
+    def __init__(self, history: int = 50):
+        self.recent: Deque[Trace] = collections.deque(maxlen=history)
+        # Traces by sequence number of their chat event
+        self._pending: collections.OrderedDict[int, Trace] = collections.OrderedDict()
+        # Traces by key of their chat event or log line in the shared state journal
+        self._shared: collections.OrderedDict[str, Trace] = collections.OrderedDict()
+        # Traces of log lines by device index, with the log textbox version that shows them
+        self._lines: Dict[int, Deque[Tuple[int, Trace]]] = {}
+        self._keys = itertools.count()
+        self._current = threading.local()
+        self._history = history
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Trace | None:
+        """
+        Trace of the log being parsed in this thread, see :meth:`tracing`.
+        """
+        return getattr(self._current, "trace", None)
+
+    @contextlib.contextmanager
+    def tracing(self, log: LogRecord):
+        """
+        Trace :param:`log` while it is being parsed. Chat events published meanwhile are attributed to it.
+        """
+        trace = Trace(log.device, log.message)
+        for stage, at in (("device", log.time), ("orchestrator", log.received), ("ingest", log.ingested)):
+            if at is not None:
+                trace.mark(stage, at / 1000)
+        trace.mark("parse")
+        self.recent.append(trace)
+
+        self._current.trace = trace
+        try:
+            yield trace
+        finally:
+            self._current.trace = None
+
+    def published(self, trace: Trace, seq: int):
+        """
+        :param:`trace` caused chat event :param:`seq`. Only the first chat event of a trace is followed.
+        """
+        if "publish" in trace.times:
+            return
+        trace.mark("publish")
+        self._wait(seq, trace)
+
+    def handover(self, trace: Trace) -> str | None:
+        """
+        Key for the chat event of :param:`trace` published to the shared state journal, see :meth:`applied`, or for
+        its log line, see :meth:`line_applied`. Mark the ``publish`` stage when it has been published.
+
+        :return: Key, or ``None`` if the trace already has a chat event
+        """
+        if "publish" in trace.times:
+            return None
+        key = f"{os.getpid()}:{next(self._keys)}"
+        with self._lock:
+            self._shared[key] = trace
+            while len(self._shared) > self._history:
+                self._shared.popitem(last=False)
+        return key
+
+    def applied(self, key: str, seq: int):
+        """
+        Chat event :param:`key` of the shared state journal was published to this worker as :param:`seq`. Traces of
+        other workers are ignored.
+        """
+        with self._lock:
+            trace = self._shared.pop(key, None)
+        if trace is not None:
+            self._wait(seq, trace)
+
+    def line_applied(self, key: str, idx: int, version: int):
+        """
+        Log line :param:`key` was added to the log textbox of device :param:`idx`, as its :param:`version`. Traces of
+        other workers are ignored.
+        """
+        with self._lock:
+            if (trace := self._shared.pop(key, None)) is not None:
+                self._lines.setdefault(idx, collections.deque(maxlen=self._history)).append((version, trace))
+
+    def lines_delivered(self, idx: int, version: int):
+        """
+        Log textbox of device :param:`idx` has been pushed to a browser at :param:`version`.
+        """
+        with self._lock:
+            waiting = self._lines.get(idx, ())
+            while waiting and waiting[0][0] <= version:
+                waiting.popleft()[1].mark("ui")
+
+    def _wait(self, seq: int, trace: Trace):
+        with self._lock:
+            self._pending[seq] = trace
+            while len(self._pending) > self._history:
+                self._pending.popitem(last=False)
+
+    def paced(self, cursor: int):
+        """
+        Chat events before :param:`cursor` are pushed to a browser next, after the pacing delay.
+        """
+        with self._lock:
+            for seq, trace in self._pending.items():
+                if seq >= cursor:
+                    break
+                if "pacing" not in trace.times:
+                    trace.mark("pacing")
+
+    def delivered(self, cursor: int):
+        """
+        Chat events before :param:`cursor` have been pushed to a browser.
+        """
+        with self._lock:
+            while self._pending:
+                seq = next(iter(self._pending))
+                if seq >= cursor:
+                    break
+                self._pending.pop(seq).mark("ui")
+
+    def clear(self):
+        with self._lock:
+            self.recent.clear()
+            self._pending.clear()
+            self._shared.clear()
+            self._lines.clear()
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """
+        Median and 95th percentile delay of each stage in seconds, over the recent traces.
+        """
+        delays: Dict[str, List[float]] = {stage: [] for stage in STAGES[1:]}
+        for trace in list(self.recent):
+            for stage, delay in trace.delays().items():
+                if delay is not None:
+                    delays[stage].append(delay)
+
+        result = {}
+        for stage, values in delays.items():
+            if not values:
+                continue
+            if len(values) > 1:
+                quantiles = statistics.quantiles(values, n=20, method="inclusive")
+                result[stage] = {"p50": statistics.median(values), "p95": quantiles[18], "count": len(values)}
+            else:
+                result[stage] = {"p50": values[0], "p95": values[0], "count": 1}
+        return result
+
+
+tracer = Tracer(settings.TRACE_HISTORY)
@@ -3,34 +3,54 @@ UI for WasmIoT demo.
 ====================
 """
 
+import asyncio
 import collections
 import datetime
+import functools
+import itertools
 import logging
 import random
 import re
-import threading
 import time
-from typing import Callable, Iterator, List, Literal, Tuple
+from typing import Dict, List, Tuple
 import gradio as gr
 import os
 from gettext import gettext as _
-import requests
 
-from ._typing import Device
+from . import jobs, metrics, shared_state
+from ._typing import DeviceID, ModuleID
+from .client import get_client
+from .event_bus import EventBus
+from .image_cache import get_image_cache
+from .inventory import get_inventory
+from .log_buffer import ChangeNotifier, Coalescer, LogBuffer
+from .log_record import LogRecord, format_ms
+from .log_rules import RuleSet
+from .log_store import Cursor, get_log_store
 from .settings import settings
-from .SETUP import DEVICES, DEPLOYMENTS, logs_queue
-from .utils import do_deployment, find_deployment_solution, get_modules, health_check, run_deployment
+from .tracing import STAGES, Trace, tracer
+from .SETUP import DEVICES, DEVICE_IDS, DEVICE_INDEX, logs_queue, logs_ready
+from .utils import find_deployment_solution, get_modules, health_check
 
 labels_path = os.path.join(os.path.dirname(__file__), "labels.txt")
-labels = open(labels_path).read().splitlines()
+
+
+@functools.cache
+def get_labels() -> List[str]:
+    """
+    Class labels of the image classification results, read on first use.
+    """
+    with open(labels_path) as file:
+        return file.read().splitlines()
+
 
 os.environ.setdefault('GRADIO_ANALYTICS_ENABLED', 'false')
 
 # Internal logger
 logger = logging.getLogger(__name__)
 
-# Pool of outgoing chat messages. See: https://www.gradio.app/docs/gradio/chatbot#behavior
-chat_history = collections.deque(maxlen=15)
+# Outgoing chat messages, shared by all viewers. See: https://www.gradio.app/docs/gradio/chatbot#behavior
+chat_history: EventBus[list] = EventBus(capacity=256)
 
 # Precompiled regexes for log parsing
 RE_WASM_PREPARE = re.compile(r"Preparing Wasm module '(?P<module_name>.+)'")
@@ -41,155 +61,612 @@ RE_RESULT_URL = re.compile(r"Result url: (?P<url>.+)")
 RE_EXEC_RESULT = re.compile(r"Execution result: (?P<result>.+)")
 RE_ERROR = re.compile(r"Error running WebAssembly function '(?P<function_name>.+)'")
 
-log_history = [
-    collections.deque(maxlen=100),
-    collections.deque(maxlen=100)
-]
+# Rendered log lines per device. Written by :func:`parse_logs`, read by the log textboxes.
+log_history: List[LogBuffer] = [LogBuffer(maxlen=settings.LOG_HISTORY_LENGTH) for _ in DEVICES]
+
+# Notified when :data:`log_history` changes
+log_updates = ChangeNotifier()
+
+# Repeated messages of a device, shown as one line and one chat message
+log_coalescer = Coalescer(settings.LOG_COALESCE_WINDOW)
+
+# Rendered message of the current run of each device, for its counted line
+log_runs: Dict[int, str] = {}
+
+# Chat event of the last log of each device that had one, its message and the original event, see :func:`count_event`
+log_bubbles: Dict[int, Tuple[list, str, list]] = {}
+
+# Chat events to be replaced by key, see :func:`update_event`
+pending_events: Dict[str, list] = {}
+_event_keys = itertools.count()
+
+PARSE_BATCH_SECONDS = metrics.Histogram("icwe_log_parse_batch_seconds", "Duration of parsing a batch of logs")
+LOGS_PARSED = metrics.Counter("icwe_logs_parsed_total", "Logs parsed")
+CALLBACK_SECONDS = metrics.Histogram("icwe_ui_callback_seconds", "Duration of UI event handlers", ["callback"])
+
+metrics.Gauge("icwe_logs_queue_length", "Logs waiting to be parsed", function=lambda: len(logs_queue))
+metrics.Gauge("icwe_chat_events", "Chat events kept for viewers", function=lambda: len(chat_history))
+metrics.Gauge("icwe_log_history_lines", "Log lines kept per device", ["device"],
+              function=lambda: {(device['name'],): len(device_history(idx)) for idx, device in enumerate(DEVICES)})
+for _field in ("received", "dropped", "coalesced"):
+    metrics.Counter(f"icwe_device_logs_{_field}_total", f"Device logs {_field} by the log queue", ["device"],
+                    function=lambda field=_field: {(device,): stats[field]
+                                                   for device, stats in logs_queue.stats_dict().items()})
 
 def download_image(url, save_path):
-    response = requests.get(url, stream=True)
-    response.raise_for_status()  # Ensure we got a successful response
+    get_client().download(url, save_path)
+
+def device_history(idx: int) -> LogBuffer:
+    """
+    Log buffer of device at :param:`idx`, created if devices were discovered after startup.
+    """
+    while len(log_history) <= idx:
+        log_history.append(LogBuffer(maxlen=settings.LOG_HISTORY_LENGTH))
+    return log_history[idx]
 
-    with open(save_path, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=8192):
-            file.write(chunk)
 
-def device_event(idx: Literal[0, 1, -1], msg = str | Tuple[str, str|None]):
+def device_event(idx: int, msg = str | Tuple[str, str|None], log: LogRecord | None = None,
+                 replaceable: bool = False) -> str | None:
     """
     New device message for displaying in the chat.
 
-    :param idx: Index of the device. 0 for left, 1 for right, -1 for both.
+    Devices in the first half of :data:`DEVICES` are shown on the left side of the chat, the rest on the right. With
+    more than two devices, text messages are prefixed with the device name.
+
+    :param idx: Index of the device, or -1 for all.
     :param msg: Message to display. If a tuple, the first element is the image URL, the second is the text.
+    :param log: Device log the message is for. Repeats of the log update the count of this message.
+    :param replaceable: Whether the message is a placeholder, replaced later with :func:`update_event`
+    :return: Key for :func:`update_event` if :param:`replaceable`
     """
+    event = _chat_event(idx, msg)
+    key = f"{os.getpid()}:{next(_event_keys)}" if replaceable else None
+    text = log.text if log is not None else None
+    trace = tracer.current
+    if (shared := shared_state.get_shared_state()) is not None:
+        trace_key = tracer.handover(trace) if trace is not None else None
+        shared.publish("chat", event=event, idx=idx, text=text, key=key, trace=trace_key)
+        if trace_key is not None:
+            trace.mark("publish")
+    else:
+        seq = _publish_chat(event, idx, text, key)
+        if trace is not None:
+            tracer.published(trace, seq)
+    return key
+
+
+def _chat_event(idx: int, msg: str | Tuple[str, str | None]) -> list:
     if isinstance(msg, str):
         # Check if the message is a URL
         if re.match(r"^https?://.*\.(png|jpg|jpeg|gif)\??.*$", msg) or re.match(r"tmp/.*\.(png|jpg|jpeg|gif)$", msg):
             msg = (msg, None)
+        elif idx >= 0 and len(DEVICES) > 2:
+            msg = f"**{DEVICES[idx]['name']}**: {msg}"
+
+    if idx == -1:
+        return [msg, msg]
+    elif idx * 2 < len(DEVICES):
+        return [None, msg]
+    else:
+        return [msg, None]
+
+
+@shared_state.on("chat")
+def _on_shared_chat(entry):
+    seq = _publish_chat(entry['event'], entry.get('idx'), entry.get('text'), entry.get('key'))
+    if key := entry.get('trace'):
+        tracer.applied(key, seq)
+
+
+def _publish_chat(event: list, idx: int | None = None, text: str | None = None, key: str | None = None) -> int:
+    seq = chat_history.publish(event)
+    if text is not None:
+        log_bubbles[idx] = (event, text, list(event))
+    if key is not None:
+        pending_events[key] = event
+    return seq
+
+
+def update_event(key: str, idx: int, msg: str | Tuple[str, str | None]):
+    """
+    Replace placeholder chat message :param:`key` of :func:`device_event` with :param:`msg`, in its place in the chat.
+    """
+    event = _chat_event(idx, msg)
+    if (shared := shared_state.get_shared_state()) is not None:
+        shared.publish("chat_update", key=key, event=event)
+    else:
+        _update_chat(key, event)
+
+
+@shared_state.on("chat_update")
+def _on_shared_chat_update(entry):
+    _update_chat(entry['key'], entry['event'])
+
+
+def _update_chat(key: str, event: list):
+    if (pending := pending_events.pop(key, None)) is None:
+        # Chat was cleared meanwhile
+        return
+    pending[:] = event
+    chat_history.touch()
+
+
+def count_event(idx: int, text: str, count: int):
+    """
+    Show the repeat count of device log :param:`text` on its chat message, if it has one.
+    """
+    if (shared := shared_state.get_shared_state()) is not None:
+        shared.publish("chat_count", idx=idx, text=text, count=count)
+    else:
+        _count_chat(idx, text, count)
+
+
+@shared_state.on("chat_count")
+def _on_shared_chat_count(entry):
+    _count_chat(entry['idx'], entry['text'], entry['count'])
+
+
+def _count_chat(idx: int, text: str, count: int):
+    bubble = log_bubbles.get(idx)
+    if bubble is None or bubble[1] != text:
+        # The run started with a log without chat message
+        return
 
-    match idx:
-        case -1:
-            chat_history.append([msg, msg])
-        case 0:
-            chat_history.append([None, msg])
-        case 1:
-            chat_history.append([msg, None])
+    event, _, original = bubble
+    for side, msg in enumerate(original):
+        if isinstance(msg, str):
+            event[side] = f"{msg} ×{count}"
+        elif msg is not None and msg[1]:
+            event[side] = (msg[0], f"{msg[1]} ×{count}")
+    chat_history.touch()
 
 
-def log_parser():
+# Deployment animations of the first devices
+DEPLOY_FIGURES = ["orch2raspi1.gif", "orch2raspi2.gif"]
+
+# Chat message when a device reports its deployment
+DEPLOYMENT_SENT = "🚀 Deployment sent to IoT device"
+
+# Log message rules, in order of precedence. See :mod:`.log_rules`.
+log_rules = RuleSet()
+
+log_rules.exact("Health check done", emoji="🩺")
+log_rules.exact("Module run", emoji="⚙️")
+
+
+@log_rules.exact("Deployment created", emoji="🚀", collapse=False)
+def _on_deployment_created(idx, log, match):
+    figure = DEPLOY_FIGURES[idx] if idx < len(DEPLOY_FIGURES) else "orch2raspis.gif"
+    device_event(idx, f"{settings.DEMO_URL}/figures/{figure}")
+
+    device_event(idx, DEPLOYMENT_SENT)
+    if device_id := DEVICES[idx].get('_id'):
+        jobs.get_engine().device_reported(device_id, jobs.DEPLOYED)
+
+
+@log_rules.pattern(RE_WASM_PREPARE, emoji="📦")
+@log_rules.pattern(RE_WASM_FUNC_RUN, emoji="λ")
+@log_rules.pattern(RE_DEPLOY_MODULE, emoji="🚚")
+def _on_device_message(idx, log, match):
+    device_event(idx, log.text, log=log)
+
+
+@log_rules.pattern(RE_SUBCALL, emoji="📡")
+def _on_subcall(idx, log, match):
+    device_event(idx, (f"{settings.DEMO_URL}/figures/raspi2raspi.gif", log.text), log=log)
+
+
+@log_rules.pattern(RE_RESULT_URL, emoji="📷", collapse=False)
+def _on_result_url(idx, log, match):
+    # Keep the place of the image in the chat, and fetch it once for all viewers without holding up the parser
+    key = device_event(idx, f"{log.text} ⏳", replaceable=True)
+    future = get_image_cache().submit(match['url'])
+
+    def _done(future):
+        try:
+            _, thumbnail_url = future.result()
+        except Exception as e:
+            logger.warning("Could not cache result image %s: %s", match['url'], e)
+            ext = match['url'].split('.')[-1] or "jpeg"
+            thumbnail_url = f"{match['url']}?t={datetime.datetime.now().timestamp()!s}.{ext!s}"
+        # Use tuple to force image display in chat
+        update_event(key, idx, (thumbnail_url, log.text))
+
+    future.add_done_callback(_done)
+
+
+@log_rules.pattern(RE_EXEC_RESULT, emoji="📊", collapse=False)
+def _on_exec_result(idx, log, match):
+    # Parse numeric result class to textual label
+    result_class = get_labels()[int(match['result']) - 1]
+    module_name = ""
+    if module_name := log.module:
+        module_name = f"Module `{module_name}`"
+
+    md = f"📊 {module_name} result: **{result_class}**"
+    device_event(idx, md)
+
+
+@log_rules.pattern(RE_ERROR, emoji="🛑")
+def _on_error(idx, log, match):
+    device_event(idx, log.text, log=log)
+
+
+LOGLEVEL_EMOJI = {
+    'INFO': "ℹ️",
+    'ERROR': "🔴",
+    'WARNING': "⚠️",
+    'DEBUG': "🐞",
+}
+
+
+@log_rules.default
+def _on_unhandled(idx, log, match):
+    # If the first character is not emoji character, use log level to set emoji
+    if log.message and ord(log.message[0]) <= 256:
+        if emoji := LOGLEVEL_EMOJI.get(log.level):
+            log.emoji = emoji
+        else:
+            logger.debug("Unknown log level: %s", log.level)
+
+
+def report_dropped(lines: List[Tuple[int, str, bool]]):
+    """
+    Show the number of logs dropped by :data:`logs_queue` in the device logs.
+
+    :param lines: Lines to add, see :func:`add_log_lines`
+    """
+    for device_name, count in logs_queue.take_dropped().items():
+        logger.warning("Dropped %d logs of %s, parser is behind", count, device_name)
+        if (idx := DEVICE_INDEX.get(device_name)) is not None:
+            log_coalescer.reset(idx)
+            lines.append((idx, f"⚠️ {count} log lines dropped", False))
+
+
+def add_log_lines(lines: List[Tuple[int, str, bool]], traces: Dict[int, str] | None = None):
+    """
+    Add rendered lines to :data:`log_history` and notify viewers.
+
+    :param lines: Device index, line and whether it replaces the last line of the device
+    :param traces: Trace keys by position in :param:`lines`, see :meth:`.tracing.Tracer.handover`
+    """
+    for pos, (idx, line, replace) in enumerate(lines):
+        history = device_history(idx)
+        if replace:
+            history.replace_last(line)
+        else:
+            history.append(line)
+        if traces and (key := traces.get(pos)) is not None:
+            tracer.line_applied(key, idx, history.version)
+    log_updates.notify()
+
+
+@shared_state.on("logs")
+def _on_shared_logs(entry):
+    # JSON object keys are strings
+    traces = {int(pos): key for pos, key in entry.get('traces', {}).items()}
+    add_log_lines(entry['lines'], traces)
+
+
+def log_parser(batch_size: int = settings.LOG_PARSE_BATCH):
     """
     Read logs from the queue and sort them for display.
+
+    Logs are taken in batches of :param:`batch_size`, and viewers are notified after each batch. Repeats of the
+    previous message of a device within :attr:`Settings.LOG_COALESCE_WINDOW` only update the count on its line and
+    chat message, unless their rule is registered with ``collapse=False``.
     """
-    devices = {dev['name']: idx for idx, dev in enumerate(DEVICES)}
+    debug = logger.isEnabledFor(logging.DEBUG)
+    store = get_log_store()
 
     # Process all new lines
-    while logs_queue:
-        log = logs_queue.popleft()
-
-        idx = devices[log['deviceName']]
-
-        match log:
-            case {"message": "Health check done"}:
-                log['message'] = "🩺 " + log['message']
-            case {"message": "Deployment created"}:
-                log['message'] = "🚀 " + log['message']
-
-                match idx:
-                    case 0:
-                        device_event(0, f"{settings.DEMO_URL}/figures/orch2raspi1.gif")
-                    case 1:
-                        device_event(1, f"{settings.DEMO_URL}/figures/orch2raspi2.gif")
-
-                device_event(idx, "🚀 Deployment sent to IoT device")
-
-            case {"message": "Module run"}:
-                log['message'] = "⚙️ " + log['message']
-
-            case _:
-                if re.match(RE_WASM_PREPARE, log['message']):
-                    log['message'] = "📦 " + log['message']
-                    device_event(idx, log['message'])
-
-                elif re.match(RE_WASM_FUNC_RUN, log['message']):
-                    log['message'] = "λ " + log['message']
-                    device_event(idx, log['message'])
-                elif re.match(RE_DEPLOY_MODULE, log['message']):
-                    log['message'] = "🚚 " + log['message']
-                    device_event(idx, log['message'])
-                elif match := re.match(RE_SUBCALL, log['message']):
-                    log['message'] = "📡 " + log['message']
-                    device_event(idx, (f"{settings.DEMO_URL}/figures/raspi2raspi.gif", log['message']))
-                elif match := re.match(RE_RESULT_URL, log['message']):
-                    log['message'] = "📷 " + log['message']
-                    ext = match['url'].split('.')[-1] or "jpeg"
-                    # Use tuple to force image display in chat
-                    cachebuster_url = f"{match['url']}?t={datetime.datetime.now().timestamp()!s}.{ext!s}"
-                    device_event(idx, (cachebuster_url, log['message']))
-                elif match := re.match(RE_EXEC_RESULT, log['message']):
-                    log['message'] = "📊 " + log['message']
-                    # Parse numeric result class to textual label
-                    result_class = labels[int(match['result']) - 1]
-                    module_name = ""
-                    if module_name := log.get('module_name'):
-                        module_name = f"Module `{module_name}`"
-
-                    md = f"📊 {module_name} result: **{result_class}**"
-                    device_event(idx, md)
-                elif match := re.match(RE_ERROR, log['message']):
-                    log['message'] = "🛑 " + log['message']
-                    device_event(idx, log['message'])
+    while batch := logs_queue.get_batch(batch_size):
+        started = time.perf_counter()
+        lines: List[Tuple[int, str, bool]] = []
+        traces: Dict[int, str] = {}
+        line_traces: List[Trace] = []
+        report_dropped(lines)
+
+        for log in batch:
+            idx = log.idx
+            if store is not None:
+                store.append(log)
+
+            rule, groups = log_rules.classify(log.message)
+            if log_coalescer.window:
+                if rule is None or rule.collapse:
+                    count = log_coalescer.add(idx, log.message, log.time / 1000)
                 else:
-                    # Unhandled log message
-                    # If the first character is not emoji character, use log level to set emoji
-                    _ord = ord(log['message'][0])
-                    if _ord <= 256:
-                        match log['loglevel']:
-                            case 'INFO':
-                                log['message'] = "ℹ️ " + log['message']
-                            case 'ERROR':
-                                log['message'] = "🔴 " + log['message']
-                            case 'WARNING':
-                                log['message'] = "⚠️ " + log['message']
-                            case 'DEBUG':
-                                log['message'] = "🐞 " + log['message']
-                            case _:
-                                logger.debug("Unknown log level: %s", log['level'])
-
-        # Format time with ms
-        time = datetime.datetime.fromisoformat(log['timestamp']).strftime("%H:%M:%S.%f")[:-3]
-        log_history[idx].append(f"[{time}] {log['message']}")
-        logger.getChild(f"device-{log['deviceName']}").log(logging.DEBUG, f"[{log['deviceName']}]: {log['message']}")
+                    # Handled every time, and ends the run
+                    log_coalescer.reset(idx)
+                    count = 1
+                if count > 1 and (text := log_runs.get(idx)) is not None:
+                    logs_queue.stats(log.device).coalesced += 1
+                    lines.append((idx, f"[{format_ms(log.time)}] {text} ×{count}", True))
+                    count_event(idx, text, count)
+                    continue
+
+            with tracer.tracing(log) as trace:
+                try:
+                    log_rules.handle(idx, log, rule, groups)
+                except Exception as e:
+                    # Keep the line and the rest of the batch
+                    logger.error("Error parsing log: %s", e, exc_info=True)
+
+            # Logs without a chat event are traced to their line in the log textbox
+            if (key := tracer.handover(trace)) is not None:
+                traces[len(lines)] = key
+                line_traces.append(trace)
+            log_runs[idx] = log.text
+            lines.append((idx, f"[{format_ms(log.time)}] {log.text}", False))
+            if debug:
+                logger.getChild(f"device-{log.device}").debug("[%s]: %s", log.device, log.text)
+
+        if store is not None:
+            store.flush()
+        if (shared := shared_state.get_shared_state()) is not None:
+            shared.publish("logs", lines=lines, traces=traces)
+            for trace in line_traces:
+                trace.mark("publish")
+        else:
+            for trace in line_traces:
+                trace.mark("publish")
+            add_log_lines(lines, traces)
+        PARSE_BATCH_SECONDS.observe(time.perf_counter() - started)
+        LOGS_PARSED.inc(len(batch))
+
+
+def parse_logs():
+    """
+    Parse logs in the background as they arrive.
+
+    This is the only consumer of :data:`logs_queue`, so the log textboxes only need to read :data:`log_history`.
+    """
+    while True:
+        logs_ready.wait()
+        logs_ready.clear()
+        try:
+            log_parser()
+        except Exception as e:
+            logger.error("Error parsing logs: %s", e, exc_info=True)
+            # Continue with the rest of the queue
+            if logs_queue:
+                logs_ready.set()
 
 
 def log_reader(idx):
-    log_parser()
-    return "\n".join(log_history[idx])
+    return device_history(idx).render()
 
 
-def reset(btn_deploy, btn_run):
+async def stream_logs(count: int | None = None):
     """
-    Reset the UI state.
+    Push log textbox contents to a browser whenever they change.
+
+    All viewers wait on the shared :data:`log_updates`, so an idle demo costs nothing per viewer.
+
+    :param count: Number of devices shown, defaults to all :data:`DEVICES`
+    """
+    versions = [None] * (len(DEVICES) if count is None else count)
+    while True:
+        updates = []
+        pushed = []
+        for idx in range(len(versions)):
+            history = device_history(idx)
+            if history.version != versions[idx]:
+                versions[idx] = history.version
+                updates.append(history.render())
+                pushed.append(idx)
+            else:
+                updates.append(gr.update())
+
+        if pushed:
+            yield updates
+            for idx in pushed:
+                tracer.lines_delivered(idx, versions[idx])
+
+        # Lines added while paused at the yield were not waited for yet
+        await log_updates.wait(settings.LOG_STREAM_KEEPALIVE, predicate=lambda: any(
+            device_history(idx).version != version for idx, version in enumerate(versions)))
+
+
+async def stream_modules(count: int | None = None):
+    """
+    Push module dropdown choices to a browser when the orchestrator inventory changes.
+
+    :param count: Number of devices shown, defaults to all :data:`DEVICES`
+    """
+    inventory = get_inventory()
+    devices = DEVICES[:count]
+    version = None
+    while True:
+        if inventory.version != version:
+            version = inventory.version
+            yield [gr.Dropdown(choices=get_modules(device.get('_id'))) for device in devices]
+
+        await inventory.updates.wait(settings.LOG_STREAM_KEEPALIVE,
+                                     predicate=lambda shown=version: inventory.version != shown)
+
+
+@shared_state.on("clear")
+def clear_state(entry: dict | None = None):
+    """
+    Clear logs and chat.
     """
     logs_queue.clear()
+    log_coalescer.reset()
+    tracer.clear()
     chat_history.clear()
+    log_bubbles.clear()
+    pending_events.clear()
+    if (store := get_log_store()) is not None:
+        store.new_session()
 
     for history in log_history:
         history.clear()
+    log_updates.notify()
+
+
+@shared_state.on("reset")
+def _on_shared_reset(entry):
+    """
+    Rebuild the view from a compacted journal. Logs waiting for the parser are left alone.
+    """
+    chat_history.restore([])
+    log_bubbles.clear()
+    pending_events.clear()
+    for history in log_history:
+        history.clear()
+    log_updates.notify()
+
+
+@shared_state.on("chat_history")
+def _on_shared_chat_history(entry):
+    chat_history.restore(entry['events'])
+
+
+@shared_state.snapshot
+def _shared_snapshot():
+    if events := chat_history.read(0)[0]:
+        yield "chat_history", {"events": events}
+    lines = [(idx, line, False) for idx, history in enumerate(log_history) for line in history]
+    if lines:
+        yield "logs", {"lines": lines}
+
+
+def reset(btn_deploy, btn_run, btn_deploy_run):
+    """
+    Reset the UI state.
+    """
+    if (shared := shared_state.get_shared_state()) is not None:
+        shared.publish("clear")
+    else:
+        clear_state()
 
     return (
         gr.Button("Deploy 📦", interactive=True),
         gr.Button("Run ▶️", interactive=True),
+        gr.Button("Deploy & run ⏩", interactive=True),
         []
     )
 
 def test_chatbot_yielding():
     history = []
+    subscription = chat_history.subscribe(from_start=True)
 
-    while len(chat_history):
+    while len(subscription):
         time.sleep(settings.STEP_DELAY)
-        history.append(chat_history.popleft())
+        history.append(subscription.next())
         yield history
 
 
+async def stream_chat():
+    """
+    Push chat events to a browser as they are published.
+
+    Every viewer has its own :class:`.event_bus.Subscription`, so all viewers see the same flow. The view keeps
+    references to the published events, not copies.
+    """
+    subscription = chat_history.subscribe()
+    history = collections.deque(maxlen=settings.CHAT_HISTORY_LENGTH)
+    last_shown = 0.
+
+    while True:
+        if subscription.was_cleared():
+            # Restored events are shown at once, not paced like new ones
+            history.clear()
+            history.extend(subscription.rebase())
+            yield list(history)
+        elif subscription.was_updated():
+            # Shown events were changed in place, like repeat counts
+            yield list(history)
+
+        while (event := subscription.next()) is not None:
+            # Pace consecutive messages for presentation. First message after a pause is shown right away.
+            if (delay := last_shown + pacing_delay() - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            tracer.paced(subscription.cursor)
+            history.append(event)
+            yield list(history)
+            last_shown = time.monotonic()
+            tracer.delivered(subscription.cursor)
+
+        await subscription.wait_async(settings.LOG_STREAM_KEEPALIVE)
+
+
+def trace_panel() -> str:
+    """
+    Latency of the recent device logs by stage, as markdown.
+    """
+    percentiles = tracer.percentiles()
+    lines = [
+        "| Stage | p50 ms | p95 ms | Logs |",
+        "|---|---:|---:|---:|",
+    ]
+    for stage in STAGES[1:]:
+        if row := percentiles.get(stage):
+            lines.append(f"| {stage} | {row['p50'] * 1000:.1f} | {row['p95'] * 1000:.1f} | {row['count']} |")
+
+    lines += [
+        "",
+        "| Device | Message | " + " | ".join(STAGES[1:]) + " |",
+        "|---|---|" + "---:|" * (len(STAGES) - 1),
+    ]
+    for trace in list(tracer.recent)[-10:][::-1]:
+        delays = [f"{delay * 1000:.0f}" if delay is not None else "" for delay in trace.delays().values()]
+        message = trace.message[:40].replace("|", "\\|")
+        lines.append(f"| {trace.device} | {message} | " + " | ".join(delays) + " |")
+    return "\n".join(lines)
+
+
+# Log levels in the history filter
+HISTORY_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+
+def history_sessions():
+    """
+    Sessions of the log store for the history filter, newest first. Value ``0`` is all sessions.
+    """
+    choices = [("All sessions", 0)]
+    if (store := get_log_store()) is not None:
+        for session, count in store.sessions():
+            started = datetime.datetime.fromtimestamp(session).strftime("%Y-%m-%d %H:%M:%S")
+            current = " (current)" if session == store.session else ""
+            choices.append((f"{started}{current}, {count} logs", session))
+    return gr.Dropdown(choices=choices)
+
+
+def history_page(session: int, device: str, level: str, module: str, page: Tuple[Cursor, Cursor] | None = None,
+                 direction: str = "latest"):
+    """
+    Page of stored logs matching the filters.
+
+    :param page: Positions of the first and last log on the current page
+    :param direction: ``latest``, or ``older`` or ``newer`` than :param:`page`
+    :return: Rendered logs and the new page
+    """
+    if (store := get_log_store()) is None:
+        return "Log store is disabled, see LOG_STORE_DIR", None
+
+    filters = {"session": session or None, "device": device or None, "level": level or None, "module": module or None}
+    if direction == "older" and page:
+        records = store.query(older=page[0], limit=settings.LOG_HISTORY_LENGTH, **filters)
+    elif direction == "newer" and page:
+        records = store.query(newer=page[1], limit=settings.LOG_HISTORY_LENGTH, **filters)
+    else:
+        records = store.query(limit=settings.LOG_HISTORY_LENGTH, **filters)
+
+    if not records:
+        # Stay on the current page at either end
+        return (gr.update(), page) if page and direction != "latest" else ("No logs found", None)
+
+    lines = []
+    for _cursor, record in records:
+        log_time = datetime.datetime.fromtimestamp(record['t']).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        module_name = f" [{record['mod']}]" if 'mod' in record else ""
+        lines.append(f"[{log_time}] {record['d']} {record['l']}{module_name}: {record['m']}")
+    return "\n".join(lines), (records[0][0], records[-1][0])
+
+
 def ping_button(init=False):
     opts = {
         "size": "sm",
@@ -200,56 +677,95 @@ def ping_button(init=False):
         return gr.Button("Health: 🤕", variant="stop", **opts)
 
 
-def deploy(module_left, module_right):
-    logger.debug("Deploying modules %s and %s", module_left, module_right)
-    deployment = find_deployment_solution(module_left, module_right)
+# Chat messages when a job starts, by its first action
+JOB_START_EVENTS = {
+    "deploy": "🚚 Preparing to deploy",
+    "run": "⚙️ Running deployment",
+}
+
+
+def start_job(modules: Tuple[ModuleID | None, ...], *actions: str) -> jobs.Job:
+    """
+    Start job for :param:`actions` on the deployment of the selected modules.
+    """
+    logger.debug("Starting %s for modules %s", "+".join(actions), modules)
+    deployment = find_deployment_solution(*modules)
     if deployment is None:
         raise gr.Error("No deployment solution found")
 
-    device_event(-1, f"🚚 Preparing to deploy")
+    device_event(-1, JOB_START_EVENTS[actions[0]])
+    return jobs.get_engine().submit(deployment, *actions)
 
-    do_deployment(deployment)
 
+def _on_job_progress(job: jobs.Job, device: DeviceID, stage: str):
+    if (idx := DEVICE_IDS.get(device)) is None:
+        return
 
-def do_run(module_left, module_right):
-    logger.debug("Running modules %s and %s", module_left, module_right)
-    deployment = find_deployment_solution(module_left, module_right)
-    if deployment is None:
-        raise gr.Error("No deployment found")
+    match stage:
+        case jobs.DEPLOYED if "deploy" in job.skipped:
+            device_event(idx, "♻️ Module already deployed")
+        case jobs.DEPLOYED:
+            device_event(idx, "✅ Module deployed")
+        case jobs.RUNNING if job.actions[0] != "run":
+            # Pipelined run after deploy
+            device_event(idx, "⚙️ Running module")
+        case jobs.FAILED:
+            device_event(idx, f"❌ {'+'.join(job.actions).capitalize()} failed")
+
+
+jobs.get_engine().progress = _on_job_progress
 
-    device_event(-1, f"⚙️ Running deployment")
 
-    run_deployment(deployment)
+def deploy(*modules):
+    start_job(modules, "deploy").result()
 
 
-def wobbly_delay(delay: float = settings.STEP_DELAY):
+def do_run(*modules):
+    start_job(modules, "run").result()
+
+
+def wobbly(delay: float = settings.STEP_DELAY) -> float:
     """
-    Sleep for a random amount of time to make the UI more lively.
+    Randomize delay to make the UI more lively.
     """
-    time.sleep(random.uniform(0.5, 1.5) * delay)
+    return random.uniform(0.5, 1.5) * delay
 
 
-def run_yielding(target: Callable, args: Tuple) -> Iterator:
+def pacing_delay() -> float:
     """
-    Perform a blocking operation in the background and yield the results.
+    Delay between consecutive chat messages, by :attr:`Settings.CHAT_PACING`.
     """
+    match settings.CHAT_PACING:
+        case "wobbly":
+            return wobbly(settings.STEP_DELAY)
+        case "fixed":
+            return settings.STEP_DELAY
+        case _:
+            return 0.
 
-    # Start in background task, as it's blocking
-    task = threading.Thread(target=target, args=args)
-    task.start()
 
-    msgs = []
-    while True:
-        if len(chat_history) == 0 and not task.is_alive():
-            logger.debug("Task %s finished", target.__name__)
-            break
+def job_button(busy: str, *actions: str):
+    """
+    Click handler that starts a job for the selected modules and disables the button until it finishes.
 
-        if len(chat_history) > 0:
-            yield chat_history.popleft()
-            wobbly_delay()
-        else:
-            # Wait for the task to finish
-            time.sleep(settings.LOG_PULL_DELAY)
+    Chat events of the job reach the viewers through their own :func:`stream_chat`.
+
+    :param busy: Button label while the job runs
+    """
+    async def _click(btn, *modules):
+        if not any(modules):
+            raise gr.Error("Please select modules")
+
+        yield gr.Button(busy, interactive=False)
+        try:
+            await asyncio.wrap_future(start_job(modules, *actions).future)
+        except Exception:
+            yield gr.Button(btn, interactive=True)
+            raise
+
+        yield gr.Button(btn, interactive=True)
+
+    return metrics.timed(CALLBACK_SECONDS, callback="+".join(actions))(_click)
 
 
 def gradio_app():
@@ -260,9 +776,8 @@ def gradio_app():
         - Niko wants application to show more information
     """
 
-    LOG_PULL_DELAY = settings.LOG_PULL_DELAY
-
-    modules = get_modules()
+    # Browsers poll the log textboxes only if pushing is disabled
+    LOG_PULL_DELAY = settings.LOG_PULL_DELAY if settings.LOG_UI_MODE == "poll" else None
 
     with gr.Blocks(title=_("WasmIoT ICWE Demo"), theme=gr.themes.Monochrome()) as _app:
 
@@ -273,79 +788,92 @@ def gradio_app():
                                   placeholder="![Liquid Software in IoT Using WebAssembly](figures/demoposter.png)"
                                   )
 
-        with gr.Row() as row:
-            def log_reader_left():
-                return log_reader(0)
-            
-            def log_reader_right():
-                return log_reader(1)
-
-            dev_left = DEVICES[0]['name']
-            dev_right = DEVICES[1]['name']
-
-            with gr.Column():
-                gr.HTML(f"<h2>{dev_left}</h2><div class='text-muted'>{DEVICES[0]['description']}</div>")
-
-                module_left = gr.Dropdown(label=f"{dev_left} module", choices=modules)
-
-                gr.Textbox(log_reader_left,
-                           label=f"{dev_left} log messages",
-                           info="Log messages sent by the device",
-                           interactive=False,
-                           autoscroll=True,
-                           lines=4,
-                           max_lines=4,
-                           every=LOG_PULL_DELAY)
-
-            with gr.Column():
-                gr.HTML(f"<h2>{dev_right}</h2><div class='text-muted'>{DEVICES[1]['description']}</div>")
-
-                module_right = gr.Dropdown(label=f"{dev_right} module", choices=modules)
-
-                gr.Textbox(log_reader_right,
-                           label=f"{dev_right} log messages",
-                           info="Log messages sent by the device",
-                           interactive=False,
-                           autoscroll=True,
-                           lines=4,
-                           max_lines=4,
-                           every=LOG_PULL_DELAY)
+        module_inputs = []
+        log_outputs = []
+        columns = max(1, settings.UI_COLUMNS)
+        for row_start in range(0, len(DEVICES), columns):
+            with gr.Row():
+                for idx, device in enumerate(DEVICES[row_start:row_start + columns], start=row_start):
+                    with gr.Column():
+                        gr.HTML(f"<h2>{device['name']}</h2>"
+                                f"<div class='text-muted'>{device.get('description', '')}</div>")
+
+                        module_inputs.append(gr.Dropdown(label=f"{device['name']} module",
+                                                         choices=get_modules(device.get('_id'))))
+
+                        log_outputs.append(gr.Textbox(functools.partial(log_reader, idx),
+                                                      label=f"{device['name']} log messages",
+                                                      info="Log messages sent by the device",
+                                                      interactive=False,
+                                                      autoscroll=True,
+                                                      lines=4,
+                                                      max_lines=4,
+                                                      every=LOG_PULL_DELAY))
+
+        with gr.Accordion("Latency 🐢", open=False):
+            gr.Markdown("Milliseconds from the previous stage: " + " → ".join(STAGES))
+            gr.Markdown(trace_panel, every=settings.TRACE_PANEL_INTERVAL)
+
+        with gr.Accordion("History 📜", open=False):
+            with gr.Row():
+                history_session = gr.Dropdown(label="Session", choices=[("All sessions", 0)], value=0)
+                history_device = gr.Dropdown(label="Device", value="",
+                                             choices=[("All devices", "")] + [d['name'] for d in DEVICES])
+                history_level = gr.Dropdown(label="Level", choices=[("All levels", "")] + HISTORY_LEVELS, value="")
+                history_module = gr.Textbox(label="Module", placeholder="Part of the module name")
+            history_output = gr.Textbox(label="Stored log messages", interactive=False, lines=10, max_lines=20)
+            history_state = gr.State(None)
+            with gr.Row():
+                btn_older = gr.Button("◀ Older", size="sm", variant="secondary")
+                btn_latest = gr.Button("Latest 🔎", size="sm")
+                btn_newer = gr.Button("Newer ▶", size="sm", variant="secondary")
+
+            history_filters = [history_session, history_device, history_level, history_module]
+            history_session.focus(history_sessions, outputs=[history_session], show_progress="hidden")
+            for button, direction in ((btn_older, "older"), (btn_latest, "latest"), (btn_newer, "newer")):
+                button.click(metrics.timed(CALLBACK_SECONDS, callback=f"history_{direction}")(
+                                 functools.partial(history_page, direction=direction)),
+                             inputs=[*history_filters, history_state], outputs=[history_output, history_state])
 
         with gr.Row(variant="panel"):
 
-            def deploy_btn(btn, module_left, module_right):
-                if not module_left or not module_right:
-                    raise gr.Error("Please select both modules")
+            btn_deploy = gr.Button("Deploy 📦")
+            btn_deploy.click(job_button("🔨 Deploying...", "deploy"),
+                             inputs=[btn_deploy, *module_inputs], outputs=[btn_deploy])
 
-                msgs = []
-                for msg in run_yielding(target=deploy, args=(module_left, module_right)):
-                    msgs.append(msg)
-                    yield gr.Button("🔨 Deploying...", interactive=False), msgs
+            btn_run = gr.Button("Run ▶️")
+            btn_run.click(job_button("⚙️ Running...", "run"),
+                          inputs=[btn_run, *module_inputs], outputs=[btn_run])
 
-                yield gr.Button(btn, interactive=True), msgs
+            btn_deploy_run = gr.Button("Deploy & run ⏩")
+            btn_deploy_run.click(job_button("🔨 Deploying and running...", "deploy", "run"),
+                                 inputs=[btn_deploy_run, *module_inputs], outputs=[btn_deploy_run])
 
-            def run_btn(btn, module_left, module_right):
-                if not module_left or not module_right:
-                    raise gr.Error("Please select both modules")
+            btn_reset = gr.Button("Clear ⌫", size="sm", variant="secondary")
+            btn_reset.click(metrics.timed(CALLBACK_SECONDS, callback="reset")(reset),
+                            inputs=[btn_deploy, btn_run, btn_deploy_run],
+                            outputs=[btn_deploy, btn_run, btn_deploy_run, eventlog])
 
-                msgs = []
-                for msg in run_yielding(target=do_run, args=(module_left, module_right)):
-                    msgs.append(msg)
-                    yield gr.Button("⚙️ Running...", interactive=False), msgs
+            btn_ping = ping_button(init=True)
+            btn_ping.click(metrics.timed(CALLBACK_SECONDS, callback="ping")(ping_button), outputs=[btn_ping])
 
-                yield gr.Button(btn, interactive=True), msgs
+        # Orchestrator inventory may change after the app was built
+        async def _stream_modules():
+            async for updates in stream_modules(len(module_inputs)):
+                yield updates
 
-            btn_deploy = gr.Button("Deploy 📦")
-            btn_deploy.click(deploy_btn, inputs=[btn_deploy, module_left, module_right], outputs=[btn_deploy, eventlog])
+        _app.load(_stream_modules, outputs=module_inputs, concurrency_limit=None, show_progress="hidden")
 
-            btn_run = gr.Button("Run ▶️")
-            btn_run.click(run_btn, inputs=[btn_run, module_left, module_right], outputs=[btn_run, eventlog])
+        # Chat flow is pushed to all viewers, whoever pressed the button
+        _app.load(stream_chat, outputs=[eventlog], concurrency_limit=None, show_progress="hidden")
 
-            btn_reset = gr.Button("Clear ⌫", size="sm", variant="secondary")
-            btn_reset.click(reset, inputs=[btn_deploy, btn_run], outputs=[btn_deploy, btn_run, eventlog])
+        if settings.LOG_UI_MODE == "push":
+            # One long-lived stream per viewer, waiting on shared updates
+            async def _stream_logs():
+                async for updates in stream_logs(len(log_outputs)):
+                    yield updates
 
-            btn_ping = ping_button(init=True)
-            btn_ping.click(ping_button, outputs=[btn_ping])
+            _app.load(_stream_logs, outputs=log_outputs, concurrency_limit=None, show_progress="hidden")
 
     return _app
 
@@ -1,58 +1,47 @@
-from concurrent.futures import ThreadPoolExecutor
-import datetime
+import asyncio
 import logging
-import os
-import time
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
-import requests
 import gradio as gr
 
+from . import shared_state
+from .client import get_client
+from .health import get_monitor
+from .inventory import get_inventory
 from ._typing import Device, Deployment, ModuleID, DeviceID
+from .log_ingest import create_ingest
+from .log_record import LogRecord, now_ms
+from .recording import get_recorder, get_replay
 from .settings import settings
-from .SETUP import DEVICES, MODULES, DEPLOYMENTS, logs_queue
+from .snapshot import apply_state, save_snapshot, snapshot_state
+from .SETUP import (DEVICES, DEVICE_IDS, DISCOVER_DEVICES, DEVICE_INDEX, MODULES, MODULE_NAMES, DEPLOYMENTS,
+                    DEPLOYMENT_INDEX, index_devices, logs_queue, set_deployments, set_modules)
 
 logger = logging.getLogger(__name__)
 
 
-def pull_logs(orchestrator_logs_url=settings.WASMIOT_LOGGING_ENDPOINT, log_pull_delay=settings.LOG_PULL_DELAY):
+def pull_logs(orchestrator_logs_url=settings.WASMIOT_LOGGING_ENDPOINT, log_pull_delay=settings.LOG_PULL_DELAY,
+              mode=settings.LOG_INGEST_MODE):
     """
     Pull logs from orchestrator.
     
-    Populates logs_queue with logs from orchestrator.
+    Populates logs_queue with logs from orchestrator. See :mod:`.log_ingest` for the available modes. Pulling is held
+    back while the parser is behind, see :mod:`.log_queue`.
     """
 
-    global logs_queue
+    recorder = get_recorder()
 
-    logs_after = datetime.datetime.now(datetime.UTC)
-
-    if not orchestrator_logs_url:
-        raise ValueError("Orchestrator URL is not set, please set WASMIOT_LOGGING_ENDPOINT environment variable")
-
-    logger.debug("Pulling logs after from %s", orchestrator_logs_url)
-
-    devices = [dev['name'] for dev in DEVICES]
-
-    while True:
-        time.sleep(log_pull_delay)
-        try:
-            res = requests.get(orchestrator_logs_url, params={"after": logs_after.isoformat()})
-            if res.ok:
-                logs = res.json()
-
-                if not logs: continue
-
-                logger.debug("Received %d logs starting from %s", len(logs), logs_after, extra={"logs": logs})
-
-                for log in logs:
-                    if log['deviceName'] in devices:
-                        logs_queue.append(log)
-                    else:
-                        logger.debug("Unknown device name: %s", log['deviceName'])
+    def _sink(log):
+        if recorder is not None:
+            recorder.record("log", log)
+        if (record := LogRecord.from_json(log, DEVICE_INDEX)) is not None:
+            logs_queue.put(record, timeout=settings.LOG_QUEUE_PUT_TIMEOUT)
+        else:
+            logger.debug("Unknown device name: %s", log['deviceName'])
 
-                logs_after = datetime.datetime.fromisoformat(logs[-1]['dateReceived'])
-        except Exception as e:
-            logger.error("Error pulling logs: %s", e, exc_info=True)
+    ingest = create_ingest(orchestrator_logs_url, _sink, mode=mode, min_delay=log_pull_delay,
+                           backpressure=logs_queue.wait_for_space)
+    ingest.run()
 
 
 def device_log(msg, *args, device: Device | DeviceID, level=logging.INFO, **kwargs):
@@ -63,54 +52,59 @@ def device_log(msg, *args, device: Device | DeviceID, level=logging.INFO, **kwar
         - Fix the stack trace to point to the correct line in the code
     """
     if isinstance(device, DeviceID):
-        for idx, dev in enumerate(DEVICES):
-            if dev['_id'] == device:
-                device_name = dev['name']
-                break
-        else:
+        if device not in DEVICE_IDS:
             raise ValueError(f"Device with id {device} not found")
+        device_name = DEVICES[DEVICE_IDS[device]]['name']
     else:
         device_name = device["name"]
 
-    idx_list = [dev['name'] for dev in DEVICES]
-
-    if device_name in idx_list:
-        idx = idx_list.index(device_name)
-        struct_log = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "deviceName": device_name,
-            "message": msg % args,
-            # Other fields?
-        }
+    if (idx := DEVICE_INDEX.get(device_name)) is not None:
+        now = now_ms()
+        record = LogRecord(device_name, idx, now, msg % args, level=logging.getLevelName(level), ingested=now)
 
-        # Add log to logs_queue
-        logs_queue.append(struct_log)
+        if (shared := shared_state.get_shared_state()) is not None and not shared.leader:
+            # Only the leader parses logs
+            shared.publish("device_log", device=record.device, time=record.time, message=record.message,
+                           level=record.level)
+        else:
+            # Add log to logs_queue
+            logs_queue.put(record)
 
     logger.getChild(f"device_log.{device_name}").log(level, msg, *args, **kwargs)
 
 
-def pull_orchestrator_devices():
-    """
-    Get devices from orchestrator and populate :var:`MANIFESTS` with them.
-    """
-
-    global DEVICES
+@shared_state.on("device_log")
+def _on_shared_device_log(entry):
+    shared = shared_state.get_shared_state()
+    if shared.leader and (idx := DEVICE_INDEX.get(entry['device'])) is not None:
+        logs_queue.put(LogRecord(entry['device'], idx, entry['time'], entry['message'], level=entry['level'],
+                                 ingested=now_ms()))
 
-    if len(DEVICES) != 2:
-        logger.warning("Expected 2 devices to be defined in :env:`MANIFESTS`, has %d", len(DEVICES))
 
+def _needs_device_discovery() -> bool:
     # Check if MANIFESTS has all the addresses already
-    if all(dev.get('address', None) for dev in DEVICES):
+    if not DISCOVER_DEVICES and all(dev.get('address', None) for dev in DEVICES):
         logger.debug("All devices have addresses, skipping device discovery")
-        return
+        return False
+
+    return True
 
 
-    device_names = [dev['name'] for dev in DEVICES if dev.get('name')]
-    if len(device_names) != 2:
-        raise ValueError("Expected 2 devices to be named in DEVICES")
+async def fetch_orchestrator_devices():
+    """
+    Get devices from orchestrator and populate :var:`MANIFESTS` with them.
+
+    If no devices are defined in :mod:`.SETUP`, all devices known by the orchestrator are used.
+    """
+
+    if not _needs_device_discovery():
+        return
+
+    if not all(dev.get('name') for dev in DEVICES):
+        raise ValueError("Expected all devices to be named in DEVICES")
 
     devices_url = f"{settings.WASMIOT_ORCHESTRATOR_URL}/file/device"
-    res = requests.get(devices_url)
+    res = await get_client().aget(devices_url, endpoint="devices")
     data = res.json()
 
     for device_data in data:
@@ -118,195 +112,277 @@ def pull_orchestrator_devices():
             logger.info("Skipping %s, address %s", device_data['name'], device_data['communication']['addresses'][0])
             continue
 
-        if device_data['name'] not in device_names:
+        if DISCOVER_DEVICES and device_data['name'] not in DEVICE_INDEX:
+            DEVICES.append({"name": device_data['name'], "description": ""})
+            index_devices()
+
+        if device_data['name'] not in DEVICE_INDEX:
             logger.warning("Device %r not found in :var:`MANIFESTS`, skipping", device_data['name'])
             continue
             
-        idx = device_names.index(device_data['name'])
+        idx = DEVICE_INDEX[device_data['name']]
 
         DEVICES[idx].setdefault('_id', device_data['_id'])
         DEVICES[idx].setdefault('address', f"http://{device_data['communication']['addresses'][0]}:{device_data['communication']['port']}")
 
+    index_devices()
     logger.debug("Got devices: %r", DEVICES)
 
-def pull_orchestrator_modules():
-    global MODULES
+
+async def fetch_orchestrator_modules() -> bool:
+    """
+    Get modules from orchestrator.
+
+    :return: Whether modules have changed since last fetch
+    """
     url = f"{settings.WASMIOT_ORCHESTRATOR_URL}/file/module"
-    res = requests.get(url)
-    if data := res.json():
-        MODULES = data
+    data = await get_inventory().fetch(url, endpoint="modules")
+    if data is None:
+        return False
+    if data:
+        set_modules(data)
         logger.info("Got %d modules from %s", len(MODULES), url)
+        return True
     else:
         raise ValueError(f"Error getting modules from {url}")
 
 
-def pull_orchestrator_deployments():
+async def fetch_orchestrator_deployments() -> bool:
     """
     Get deployments from orchestrator.
+
+    :return: Whether deployments have changed since last fetch
     """
-    global DEPLOYMENTS
     deployments_url = f"{settings.WASMIOT_ORCHESTRATOR_URL}/file/manifest"
-    res = requests.get(deployments_url)
-    if data := res.json():
-        DEPLOYMENTS = data
+    data = await get_inventory().fetch(deployments_url, endpoint="deployments")
+    if data is None:
+        return False
+    if data:
+        set_deployments(data)
         logger.info("Got %d deployments from %s", len(DEPLOYMENTS), deployments_url)
+        return True
     else:
         raise ValueError(f"Error getting deployments from {deployments_url}")
 
 
-def get_modules() -> List[Tuple[str, ModuleID]]:
+def pull_orchestrator_devices():
+    get_client().run(fetch_orchestrator_devices())
+
+
+def pull_orchestrator_modules():
+    get_client().run(fetch_orchestrator_modules())
+
+
+def pull_orchestrator_deployments():
+    get_client().run(fetch_orchestrator_deployments())
+
+
+def pull_orchestrator_state(snapshot_path=settings.SNAPSHOT_PATH):
     """
-    Get modules that are used by deployments.
+    Get devices, modules and deployments from orchestrator concurrently, and save them as a snapshot.
+
+    Modules and deployments are only applied if they have changed, see :class:`.inventory.InventoryCache`. If a fetch
+    fails, what the others applied is still announced and saved before the error is raised.
 
-    :return: List of tuples with module name and module id
+    :param snapshot_path: Where to save the snapshot. Set empty to skip.
+    :return: Whether modules or deployments have changed
     """
-    global DEPLOYMENTS, MODULES
 
-    # Generate mapping of module id's to module names
-    module_map = {module['_id']: module['name'] for module in MODULES}
+    async def _fetch_all():
+        return await asyncio.gather(
+            fetch_orchestrator_devices(),
+            fetch_orchestrator_modules(),
+            fetch_orchestrator_deployments(),
+            return_exceptions=True,
+        )
+
+    results = get_client().run(_fetch_all())
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if not any(result is True for result in results[1:]):
+        if errors:
+            raise errors[0]
+        return False
+
+    get_inventory().changed()
+    if snapshot_path:
+        save_snapshot(snapshot_path)
+    if (recorder := get_recorder()) is not None:
+        recorder.record("state", snapshot_state())
+    if (shared := shared_state.get_shared_state()) is not None:
+        shared.publish("state", state=snapshot_state())
+    if errors:
+        raise errors[0]
+    return True
+
+
+@shared_state.on("state")
+def _on_shared_state(entry):
+    if not shared_state.get_shared_state().leader and apply_state(entry['state'], "shared state"):
+        get_inventory().changed()
+
+
+@shared_state.snapshot
+def _shared_snapshot():
+    if MODULES or DEPLOYMENTS:
+        yield "state", {"state": snapshot_state()}
+
+
+def refresh_orchestrator_state(snapshot_path=settings.SNAPSHOT_PATH):
+    """
+    Background variant of :func:`pull_orchestrator_state` that logs errors instead of raising them.
+    """
+    try:
+        if pull_orchestrator_state(snapshot_path):
+            logger.info("Orchestrator state refreshed")
+    except Exception as e:
+        logger.error("Error refreshing orchestrator state, using snapshot: %s", e, exc_info=True)
+
 
-    devices = [dev['_id'] for dev in DEVICES]
+def get_modules(device: DeviceID | None = None) -> List[Tuple[str, ModuleID]]:
+    """
+    Get modules that are used by deployments.
 
+    :param device: Only modules deployed to this device
+    :return: List of tuples with module name and module id, sorted by name
+    """
     modules = set()
-    for deployment in DEPLOYMENTS:
-        for sequence in deployment['sequence']:
-            if sequence['module'] not in module_map:
-                logger.error("Module %s not found in module list when processing deployment %s", sequence['module'], deployment['_id'])
-                continue
-            if sequence['device'] not in devices:
-                logger.error("Device %s not found in device list when processing deployment %s", sequence['device'], deployment['_id'])
-                continue
-
-            modules.add((module_map[sequence['module']], sequence['module']))
+    for step_device, module in DEPLOYMENT_INDEX.steps():
+        if module not in MODULE_NAMES:
+            logger.error("Module %s not found in module list", module)
+            continue
+        if step_device not in DEVICE_IDS:
+            logger.debug("Device %s not found in device list", step_device)
+            continue
+        if device is not None and step_device != device:
+            continue
+
+        modules.add((MODULE_NAMES[module], module))
     
-    return list(modules)
+    return sorted(modules)
 
 
-def find_deployment_solution(module_left: ModuleID, module_right: ModuleID) -> Deployment | None:
+def find_deployment_solution(*modules: ModuleID | None) -> Deployment | None:
     """
     Find a deployment that uses the given modules.
 
-    :param module_left: ID of the module used on the left device
-    :param module_right: ID of the module used on the right device
-    """
-    global DEPLOYMENTS
-
-    device_left = DEVICES[0]['_id']
-    device_right = DEVICES[1]['_id']
+    Deployment running the modules in the order of devices is preferred, but any order is accepted.
 
-    module_names = {module['_id']: module['name'] for module in MODULES}
-    deployment_names = {deployment['_id']: deployment['name'] for deployment in DEPLOYMENTS}
+    :param modules: IDs of the modules, in order of :data:`DEVICES`. Devices with no module (``None``) are not part of
+        the deployment.
+    """
+    steps = [(device['_id'], module) for device, module in zip(DEVICES, modules) if module]
+    names = [MODULE_NAMES.get(module, module) for _, module in steps]
 
-    left_module_name = module_names[module_left]
-    right_module_name = module_names[module_right]
+    logger.debug("Looking for deployment with modules %s", ", ".join(names))
 
-    logger.debug("Looking for deployment with modules %s and %s", left_module_name, right_module_name)
+    if deployment := DEPLOYMENT_INDEX.find_sequence(steps):
+        logger.info("Found deployment %r for modules %s", deployment['name'], ", ".join(map(repr, names)))
+        return deployment
 
-    for deployment in DEPLOYMENTS:
-        sequence = deployment['sequence']
-        dep_name = deployment_names[deployment['_id']]
-        if len(sequence) != 2:
-            logger.warning("Deployment %s has %d sequences, expected 2", deployment['_id'], len(sequence))
-            continue
+    if deployment := DEPLOYMENT_INDEX.find(steps):
+        logger.info("Found (reverse) deployment %r for modules %s", deployment['name'], ", ".join(map(repr, names)))
+        return deployment
 
-        if sequence[0]['device'] == device_left and sequence[0]['module'] == module_left and sequence[1]['device'] == device_right and sequence[1]['module'] == module_right:
-            logger.info("Found deployment %r for modules %r and %r", dep_name, left_module_name, right_module_name)
-            return deployment
-        elif sequence[0]['device'] == device_right and sequence[0]['module'] == module_right and sequence[1]['device'] == device_left and sequence[1]['module'] == module_left:
-            logger.info("Found (reverse) deployment %r for modules %r and %r", dep_name, right_module_name, left_module_name)
-            return deployment
-        else:
-            logger.debug("Deployment %s does not match modules %s and %s", deployment['_id'], left_module_name, right_module_name)
-            continue
-        # # Check if the deployment has the correct modules
-        # match sequence:
-        #     case [{'device': device_left, 'module': module_left}, {'device': device_right, 'module': module_right}]:
-        #         logger.info("Found deployment %s for modules %s and %s", deployment['_id'], module_names[module_left], module_names[module_right])
-        #         return deployment
-        #     case [{'device': device_right, 'module': module_right}, {'device': device_left, 'module': module_left}]:
-        #         logger.info("Found (reverse) deployment %s for modules %s and %s", deployment['_id'], module_names[module_right], module_names[module_left])
-        #         return deployment
-        #     case _:
-        #         logger.debug("Deployment %s does not match modules %s and %s", deployment['_id'], left_module_name, right_module_name)
-        #         continue
-
-    logger.warning("No deployment found for modules %s and %s", module_left, module_right)
+    logger.warning("No deployment found for modules %s", ", ".join(module for _, module in steps))
     return None
     
 
 
-def do_deployment(deployment: Deployment):
-    module_names = {module['_id']: module['name'] for module in MODULES}
+def _replayed_response(kind: str, deployment: Deployment) -> dict | None:
+    """
+    Recorded orchestrator response when replaying, see :mod:`.recording`.
+    """
+    if (replay := get_replay()) is None:
+        return None
+    try:
+        return replay.response(kind, deployment['_id'])
+    except LookupError as e:
+        raise gr.Error(str(e)) from e
+
+
+def _recorded_response(kind: str, deployment: Deployment, json: dict) -> dict:
+    if (recorder := get_recorder()) is not None:
+        recorder.record(kind, json, key=deployment['_id'])
+    return json
 
-    left = deployment['sequence'][0]
-    right = deployment['sequence'][1]
 
-    device_log("Deploying module %r", module_names[left['module']], device=left['device'])
-    device_log("Deploying module %r", module_names[right['module']], device=right['device'])
+async def ado_deployment(deployment: Deployment) -> Dict[DeviceID, str]:
+    """
+    Deploy solution to its devices.
+
+    :return: Status reported by each device
+    """
+    for step in deployment['sequence']:
+        device_log("Deploying module %r", MODULE_NAMES[step['module']], device=step['device'])
 
     logger.info("Deploying solution %s", deployment['name'])
 
-    res = requests.post(f"{settings.WASMIOT_ORCHESTRATOR_URL}/file/manifest/{deployment['_id']}", data={
-        "id": deployment['_id']
-    })
+    json = _replayed_response("deploy", deployment)
+    if json is None:
+        res = await get_client().apost(f"{settings.WASMIOT_ORCHESTRATOR_URL}/file/manifest/{deployment['_id']}", data={
+            "id": deployment['_id']
+        }, endpoint="deploy")
 
-    if not res.ok:
-        logger.error("Error deploying solution %s: %s", deployment['name'], res.text)
-        raise gr.Error("Error deploying solution: %r" % res.text)
+        if not res.is_success:
+            logger.error("Error deploying solution %s: %s", deployment['name'], res.text)
+            raise gr.Error("Error deploying solution: %r" % res.text)
 
-    json = res.json()
-    device_log("🚚 Orchestrator received device response: %r", json['deviceResponses'][left['device']]['data']['status'], device=left['device'])
-    device_log("🚚 Orchestrator received device response: %r", json['deviceResponses'][right['device']]['data']['status'], device=right['device'])
+        json = _recorded_response("deploy", deployment, res.json())
 
+    statuses = {}
+    for device in dict.fromkeys(step['device'] for step in deployment['sequence']):
+        statuses[device] = json['deviceResponses'][device]['data']['status']
+        device_log("🚚 Orchestrator received device response: %r", statuses[device], device=device)
+    return statuses
 
-def run_deployment(deployment: Deployment):
-    module_names = {module['_id']: module['name'] for module in MODULES}
 
-    left = deployment['sequence'][0]
-    right = deployment['sequence'][1]
+async def arun_deployment(deployment: Deployment) -> dict:
+    """
+    Run deployed solution.
 
-    device_log("⚙️ Running module %r", module_names[left['module']], device=left['device'])
-    device_log("⚙️ Running module %r", module_names[right['module']], device=right['device'])
+    :return: Execution response of the orchestrator
+    """
+    for step in deployment['sequence']:
+        device_log("⚙️ Running module %r", MODULE_NAMES[step['module']], device=step['device'])
 
     logger.info("Running solution %s", deployment['name'])
 
-    res = requests.post(f"{settings.WASMIOT_ORCHESTRATOR_URL}/execute/{deployment['_id']}", data={
-        "id": deployment['_id']
-    })
+    json = _replayed_response("run", deployment)
+    if json is None:
+        res = await get_client().apost(f"{settings.WASMIOT_ORCHESTRATOR_URL}/execute/{deployment['_id']}", data={
+            "id": deployment['_id']
+        }, endpoint="execute")
+
+        if not res.is_success:
+            logger.error("Error running solution %s: %s", deployment['name'], res.text)
+            raise gr.Error("Error running solution: %r" % res.text)
 
-    if not res.ok:
-        logger.error("Error running solution %s: %s", deployment['name'], res.text)
-        raise gr.Error("Error running solution: %r" % res.text)
+        json = _recorded_response("run", deployment, res.json())
 
-    json = res.json()
     logger.debug("Deployment execution response: %r", json)
+    return json
 
 
-def health_check() -> bool:
-    """
-    Ping all devices and orchestrator for health check.
-    """
+def do_deployment(deployment: Deployment) -> Dict[DeviceID, str]:
+    return get_client().run(ado_deployment(deployment))
 
-    devices = DEVICES + [{
-        "name": "orchestrator",
-        "address": os.environ.get('WASMIOT_ORCHESTRATOR_URL')
-    }]
 
-    def _ping(device: Device):
-        # If crashes here, check that the device is accessible and press "reset discovery" in orchestrator
-        try:
-            url = f"{device['address']}/health"
-            device_log("🩺 Health check to %s", url, device=device)
-            res = requests.get(url, timeout=3)
-        except requests.exceptions.Timeout:
-            device_log("🤕 Health check failed: Timeout connecting to %s", url, level=logging.ERROR, device=device)
-            return False
+def run_deployment(deployment: Deployment) -> dict:
+    return get_client().run(arun_deployment(deployment))
 
-        return res.ok
 
+def health_check() -> bool:
+    """
+    Health of all devices and orchestrator.
 
-    # run in thread executor pool
-    with ThreadPoolExecutor() as executor:
-        results = executor.map(_ping, devices)
+    Served from the cached status of :class:`.health.HealthMonitor`, or of the leader worker or the replayed
+    recording. If none is available, probes all targets once. Replays never probe the recorded devices.
+    """
+    monitor = get_monitor()
+    if not monitor.running and monitor.shared_status is None and get_replay() is None:
+        monitor.probe_all()
+    else:
+        # Refresh in background for the next caller
+        monitor.wake()
 
-    return all(results)
+    return monitor.healthy()